@@ -0,0 +1,91 @@
+#this file will report how long importing the harvester takes, from python -X importtime in a fresh interpreter
+#usage: python benchmark/import_time.py [--module utils.registry] [--top 15] [--runs 3] [--budget 0.2] [--output report.json]
+#the heavy libraries (rdflib, requests, jinja2) are loaded on first use, the report lists which of them were imported anyway
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SRC_FOLDER = os.path.join(os.path.dirname(BENCHMARK_FOLDER), "src")
+#libraries that should not be loaded by importing the harvester
+HEAVY_MODULES = ["rdflib", "rdflib.plugins.sparql", "requests", "urllib3", "jinja2", "asyncio"]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Report the import time of the harvester modules")
+    parser.add_argument("--module", default="utils.registry", help="module to import")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to report")
+    parser.add_argument("--runs", type=int, default=3, help="number of fresh interpreters, the fastest run is reported")
+    parser.add_argument("--budget", type=float, default=None, help="exit with 1 when the import takes longer than this many seconds")
+    parser.add_argument("--output", default=None, help="write the report as json to this file")
+    return parser.parse_args(argv)
+
+def parse_importtime(stderr):
+    '''
+    parse the output of python -X importtime
+    :param stderr: the stderr of the interpreter
+    :return: list of (module, self seconds, cumulative seconds, depth) in import order
+    '''
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_time) / 1e6, int(cumulative) / 1e6, depth))
+    return modules
+
+def own_modules(modules, module):
+    '''
+    the modules that were imported on behalf of a module, without the interpreter start up (site, encodings, ...)
+    importtime reports a module after the modules it imports, so they are the lines after the previous top level import
+    '''
+    end = max(i for i, (name, _, _, depth) in enumerate(modules) if name == module and depth == 0)
+    start = max((i + 1 for i, (_, _, _, depth) in enumerate(modules[:end]) if depth == 0), default=0)
+    return modules[start:end + 1]
+
+def measure(module):
+    '''
+    import a module in a fresh interpreter
+    :return: the parsed importtime lines and the heavy modules that ended up in sys.modules
+    '''
+    code = "import sys, json, {0}; print(json.dumps([m for m in {1!r} if m in sys.modules]))".format(module, HEAVY_MODULES)
+    #warnings keep the logger quiet, the importtime report goes to stderr
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SRC_FOLDER, env=env, capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(result.stderr), json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    args = parse_args(argv)
+    runs = []
+    for _ in range(args.runs):
+        modules, loaded = measure(args.module)
+        total = own_modules(modules, args.module)[-1][2]
+        runs.append((total, modules, loaded))
+    total, modules, loaded = min(runs, key=lambda run: run[0])
+    own = own_modules(modules, args.module)
+    report = {
+        "module": args.module,
+        "import_time": round(total, 4),
+        "runs": [round(run[0], 4) for run in runs],
+        "heavy_modules_loaded": loaded,
+        "slowest_modules": [
+            {"module": name, "self": round(self_time, 4), "cumulative": round(cumulative, 4)}
+            for name, self_time, cumulative, _ in sorted(own, key=lambda item: item[1], reverse=True)[:args.top]
+        ],
+    }
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.budget is not None and total > args.budget:
+        print(f"importing {args.module} took {total:.3f}s, more than the budget of {args.budget}s", file=sys.stderr)
+        sys.exit(1)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#this file will run Registry.build end to end against a local synthetic registry and report how long it took
+#usage: python benchmark/run_benchmark.py --rows 200 --fanout 3 --depth 1 --latency 0.02 [--runs 2] [--output report.json]
+#the second and later runs reuse the http cache and the build manifest of the first run
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SRC_FOLDER = os.path.join(os.path.dirname(BENCHMARK_FOLDER), "src")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Registry.build against a local synthetic registry")
+    parser.add_argument("--rows", type=int, default=100, help="number of csv rows")
+    parser.add_argument("--fanout", type=int, default=3, help="number of profiles every ro-crate conformsTo")
+    parser.add_argument("--depth", type=int, default=0, help="levels of nested registries below every ro-crate")
+    parser.add_argument("--profiles", type=int, default=None, help="number of distinct profiles (default: rows)")
+    parser.add_argument("--describedby", type=float, default=0.5, help="fraction of entries behind an html describedby link")
+    parser.add_argument("--rocrate-context", type=float, default=0.5, help="fraction of ro-crates that use the ro-crate context")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every response is delayed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of documents that answer with a 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=1, help="number of builds, later builds reuse the cache and manifest")
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second the rate limiter allows for the local host")
+    parser.add_argument("--output", default=None, help="write the report as json to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="registry-benchmark-")
+    #the settings of the harvester are read from the environment when its modules are imported
+    os.environ["HTTP_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["RATE_LIMIT_PER_SECOND"] = str(args.rate)
+    os.environ["RATE_LIMIT_BURST"] = str(max(1, int(args.rate)))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, SRC_FOLDER)
+    sys.path.insert(0, BENCHMARK_FOLDER)
+    from synthetic_registry import SyntheticRegistry
+
+    registry_server = SyntheticRegistry(
+        rows=args.rows, fanout=args.fanout, depth=args.depth, profiles=args.profiles,
+        describedby=args.describedby, rocrate_context=args.rocrate_context, latency=args.latency, error_rate=args.error_rate, seed=args.seed,
+    )
+    registry_server.start()
+    shutil.copytree(os.path.join(SRC_FOLDER, "templates"), os.path.join(workdir, "templates"))
+    os.makedirs(os.path.join(workdir, "data"))
+    with open(os.path.join(workdir, "data", "registry.csv"), "w") as f:
+        f.write(registry_server.csv())
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from utils.singleton.location import Location
+        Location(root=workdir)
+        from utils.registry import Registry
+        runs = []
+        for run in range(args.runs):
+            before = registry_server.stats()
+            registry = Registry(data_path=os.path.join(workdir, "data"))
+            start = time.perf_counter()
+            registry.build()
+            wall_time = time.perf_counter() - start
+            after = registry_server.stats()
+            #the timings and counters per stage come from the metrics the build writes to build/metrics.json
+            metrics = registry.metrics.report()
+            runs.append({
+                "run": run + 1,
+                "wall_time": round(wall_time, 4),
+                "requests": after["requests"] - before["requests"],
+                "bytes": after["bytes"] - before["bytes"],
+                "profiles": len(registry.profile_metadate_dicts),
+                "entry_errors": len(registry.entry_errors),
+                "deferred_entries": len(registry.deferred_entries),
+                "cache_hit_rate": metrics["totals"].get("cache_hit_rate"),
+                "triples_parsed": metrics["totals"].get("triples_parsed", 0),
+                "documents_read_as_json": metrics["totals"].get("documents_read_as_json", 0),
+                "documents_parsed_on_demand": metrics["totals"].get("documents_parsed_on_demand", 0),
+                "stages": metrics["stages"],
+                "slowest_entries": sorted(
+                    ((uri, counters.get("harvest_time", 0)) for uri, counters in metrics["entries"].items()),
+                    key=lambda item: item[1], reverse=True
+                )[:5],
+            })
+    finally:
+        os.chdir(cwd)
+        registry_server.stop()
+    report = {
+        "settings": vars(args),
+        "runs": runs,
+        #ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+if __name__ == "__main__":
+    main()
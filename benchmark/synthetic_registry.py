@@ -0,0 +1,205 @@
+#this file will contain a local http server that generates synthetic profile registries for the benchmark
+#every document is generated from its path, so the server needs no files and the same settings always give the same registry
+#
+#   /crate/<i>/                          landing page with a describedby link (only for describedby entries)
+#   /crate/<i>/ro-crate-metadata.json    ro-crate that conformsTo `fanout` profiles and links to a nested registry,
+#                                        or with the ro-crate context, that lists them in an ItemList (read as json by the harvester)
+#   /registry/<i>/<level>                turtle registry (hasPart/itemListElement) one level deeper, the last level lists profiles
+#   /profile/<k>                         turtle profile, profiles are shared between crates
+import json
+import time
+import random
+import hashlib
+import threading
+import http.server
+from collections import Counter
+
+class SyntheticRegistry():
+    def __init__(self, rows=100, fanout=3, depth=0, profiles=None, describedby=0.5, rocrate_context=0.5, latency=0.0, error_rate=0.0, failing=None, etags=True, seed=0):
+        '''
+        :param rows: number of csv rows (entries) in the registry
+        :param fanout: number of profiles every ro-crate conformsTo
+        :param depth: number of nested registry-of-registries levels below every ro-crate
+        :param profiles: number of distinct profiles, defaults to rows so profiles are shared between crates
+        :param describedby: fraction of the entries that is an html landing page with a describedby link
+        :param rocrate_context: fraction of the ro-crates that use the ro-crate 1.1 context instead of an inline @vocab context
+        :param latency: seconds every response is delayed
+        :param error_rate: fraction of the documents that answer with a 500
+        :param failing: path prefix of the documents that always answer with a 500, e.g. /profile/
+        :param etags: False answers without ETag, the documents can then not be cached
+        :param seed: seed for the choices above
+        '''
+        self.rows = rows
+        self.fanout = fanout
+        self.depth = depth
+        self.profiles = profiles or max(1, rows)
+        self.describedby = describedby
+        self.rocrate_context = rocrate_context
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failing = failing
+        self.etags = etags
+        self.seed = seed
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.base = None
+
+    def __repr__(self) -> str:
+        return f"SyntheticRegistry(rows={self.rows}, fanout={self.fanout}, depth={self.depth}, base={self.base})"
+
+    def chance(self, *key):
+        #deterministic number in [0, 1) for a key, independent of the order of the requests
+        digest = hashlib.sha256(repr((self.seed,) + key).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+    def entry_uri(self, i):
+        if self.chance("describedby", i) < self.describedby:
+            return f"{self.base}/crate/{i}/"
+        return f"{self.base}/crate/{i}/ro-crate-metadata.json"
+
+    def csv(self):
+        lines = ["URI,contact"]
+        for i in range(self.rows):
+            lines.append(f"{self.entry_uri(i)},benchmark{i}@example.org")
+        return "\n".join(lines) + "\n"
+
+    def profile_uris(self, i):
+        picker = random.Random(f"{self.seed}-{i}")
+        return [f"{self.base}/profile/{picker.randrange(self.profiles)}" for _ in range(self.fanout)]
+
+    def landing_page(self, i):
+        return "text/html", (
+            "<html><head><title>crate {0}</title>"
+            "<link rel=describedby href=\"./ro-crate-metadata.json\" type=\"application/ld+json\"/>"
+            "</head><body>crate {0}</body></html>"
+        ).format(i)
+
+    def crate(self, i):
+        if self.chance("rocrate_context", i) < self.rocrate_context:
+            return self.rocrate_crate(i)
+        root = {"@id": "./", "@type": "Dataset", "name": f"crate {i}", "conformsTo": [{"@id": uri} for uri in self.profile_uris(i)]}
+        if self.depth > 0:
+            root["hasPart"] = {"@id": "#registry", "@type": "ItemList", "itemListElement": {"@id": f"{self.base}/registry/{i}/1"}}
+        document = {
+            "@context": {
+                "@vocab": "http://schema.org/",
+                "about": {"@type": "@id"},
+            },
+            "@graph": [
+                {"@id": "ro-crate-metadata.json", "@type": "CreativeWork", "about": {"@id": "./"}},
+                root,
+            ],
+        }
+        return "application/ld+json", json.dumps(document)
+
+    def rocrate_crate(self, i):
+        #the ro-crate context maps conformsTo to dct:conformsTo, so the profiles and the nested registry are listed in an ItemList
+        elements = [{"@id": uri} for uri in self.profile_uris(i)]
+        if self.depth > 0:
+            elements.append({"@id": f"{self.base}/registry/{i}/1"})
+        document = {
+            "@context": "https://w3id.org/ro/crate/1.1/context",
+            "@graph": [
+                {"@id": "ro-crate-metadata.json", "@type": "CreativeWork", "about": {"@id": "./"}, "conformsTo": {"@id": "https://w3id.org/ro/crate/1.1"}},
+                {"@id": "./", "@type": "Dataset", "name": f"crate {i}", "hasPart": {"@id": "#registry"}},
+                {"@id": "#registry", "@type": "ItemList", "itemListElement": elements},
+            ],
+        }
+        return "application/ld+json", json.dumps(document)
+
+    def nested_registry(self, i, level):
+        if level < self.depth:
+            children = [f"{self.base}/registry/{i}/{level + 1}"]
+        else:
+            children = self.profile_uris(f"{i}-{level}")
+        elements = " , ".join(f"<{uri}>" for uri in children)
+        return "text/turtle", (
+            "@prefix schema: <http://schema.org/> .\n"
+            "<> a schema:Dataset ; schema:hasPart [ a schema:ItemList ; schema:itemListElement {0} ] .\n"
+        ).format(elements)
+
+    def profile(self, k):
+        return "text/turtle", (
+            "@prefix prof: <http://www.w3.org/ns/dx/prof/> .\n"
+            "@prefix schema: <http://schema.org/> .\n"
+            "<> a prof:Profile ; schema:name \"profile {0}\" ; schema:description \"synthetic profile {0}\" ;\n"
+            "    schema:version \"1.0.{0}\" ; schema:keywords \"benchmark\", \"synthetic\" ;\n"
+            "    schema:license <https://creativecommons.org/licenses/by/4.0/> .\n"
+        ).format(k)
+
+    def document(self, path):
+        '''
+        get the content type and body of a path
+        :return: tuple of content type and body or None for unknown paths
+        '''
+        parts = [part for part in path.split("?")[0].split("/") if part]
+        try:
+            if len(parts) == 2 and parts[0] == "crate":
+                return self.landing_page(int(parts[1]))
+            if len(parts) == 3 and parts[0] == "crate" and parts[2] == "ro-crate-metadata.json":
+                return self.crate(int(parts[1]))
+            if len(parts) == 3 and parts[0] == "registry":
+                return self.nested_registry(int(parts[1]), int(parts[2]))
+            if len(parts) == 2 and parts[0] == "profile":
+                return self.profile(int(parts[1]))
+        except ValueError:
+            return None
+        return None
+
+    def start(self, port=0):
+        '''
+        start the server in a background thread
+        :return: the base uri of the server
+        '''
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with registry.lock:
+                    registry.requests[self.path] += 1
+                if registry.latency:
+                    time.sleep(registry.latency)
+                document = registry.document(self.path)
+                if document is None:
+                    return self.respond(404, "text/plain", "not found")
+                if registry.chance("error", self.path) < registry.error_rate or (registry.failing and self.path.startswith(registry.failing)):
+                    return self.respond(500, "text/plain", "synthetic error")
+                content_type, body = document
+                etag = '"{0}"'.format(hashlib.sha1(body.encode("utf-8")).hexdigest()) if registry.etags else None
+                if etag and self.headers.get("If-None-Match") == etag:
+                    return self.respond(304, content_type, "", etag=etag)
+                self.respond(200, content_type, body, etag=etag)
+
+            def respond(self, status, content_type, body, etag=None):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+                with registry.lock:
+                    registry.bytes_sent += len(data)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.base = "http://127.0.0.1:{0}".format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": sum(self.requests.values()), "unique_paths": len(self.requests), "bytes": self.bytes_sent}
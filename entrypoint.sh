@@ -29,6 +29,9 @@ pip install -r requirements.txt
 #echo "files in ./src/data"
 #tree -a ./src/data
 
+#keep the http cache in the workspace so it can be restored between runs (e.g. with actions/cache on .registry-cache)
+export HTTP_CACHE_DIR=${HTTP_CACHE_DIR:-$(pwd)/github/workspace/.registry-cache/http}
+
 #run the python script
 cd src/
 python main.py
@@ -0,0 +1,138 @@
+#this file will contain the crawler that harvests the entries of the registry and everything they link to
+#instead of every harvester recursing into its children, the uris to harvest are kept in a breadth first frontier
+#that is worked off by a fixed number of workers, so deep registries-of-registries are crawled in parallel
+import time
+from collections import namedtuple
+from utils.singleton.logger import get_logger
+from utils.instrumentation import get_metrics
+from utils.lazy_import import lazy_import
+from utils.deadlines import DeadlineExceeded, DEFAULT_ENTRY_TIMEOUT, deadline_at, earliest, expired
+
+logger = get_logger()
+asyncio = lazy_import("asyncio")
+
+#log the progress every time this many documents have been harvested
+PROGRESS_INTERVAL = 25
+
+#a uri in the frontier, the harvester is made by the resolution cache so every uri is only queued once
+#entry is the uri of the registry entry the task was discovered from, the metrics of the task are added to it
+CrawlTask = namedtuple("CrawlTask", ["harvester", "depth", "parent", "entry"])
+
+class Crawler():
+    def __init__(self, max_concurrency=8, entry_timeout=DEFAULT_ENTRY_TIMEOUT, deadline=None):
+        self.max_concurrency = max_concurrency
+        self.entry_timeout = entry_timeout #seconds harvesting the documents of an entry may take, 0 for no limit
+        self.deadline = deadline #time.monotonic() time of the end of the build budget, None for no budget
+        self.entry_time = {} #seconds spent harvesting the documents of every entry
+        self.incomplete_entries = set() #entries with documents that were deferred or ran out of time
+        self.frontier = None
+        self.workers = []
+        self.harvesters = [] #every harvester that was taken from the frontier, in breadth first order
+        self.queued = 0
+        self.in_progress = 0
+        self.harvested = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def __repr__(self) -> str:
+        return f"Crawler(max_concurrency={self.max_concurrency}, progress={self.progress()})"
+
+    def progress(self):
+        '''
+        get the progress counters of the crawl
+        :return: dict with the number of queued, in progress, harvested and failed documents
+        '''
+        return {
+            "queued": self.queued,
+            "in_progress": self.in_progress,
+            "harvested": self.harvested,
+            "failed": self.failed,
+            "deferred": self.deferred,
+        }
+
+    def profiles(self):
+        '''
+        get all the profiles that were found during the crawl
+        '''
+        profiles = set()
+        for harvester in self.harvesters:
+            profiles = profiles.union(harvester.profiles)
+        return profiles
+
+    def enqueue(self, harvester, parent=None, entry=None):
+        self.queued += 1
+        self.frontier.put_nowait(CrawlTask(harvester, harvester.depth, parent, entry or str(harvester.entry_uri)))
+
+    def start(self):
+        '''
+        start the workers, harvesters can be added with enqueue until finish is awaited
+        '''
+        self.frontier = asyncio.Queue()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.max_concurrency)]
+
+    async def finish(self):
+        '''
+        wait until the frontier is empty and stop the workers
+        :return: the flat list of all harvesters in breadth first order
+        '''
+        await self.frontier.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        logger.info(f"Crawl finished: {self.progress()}")
+        return self.harvesters
+
+    async def crawl(self, harvesters):
+        '''
+        harvest the given harvesters and all the child harvesters they discover
+        :param harvesters: the root harvesters, e.g. one per registry entry
+        :return: the flat list of all harvesters in breadth first order
+        '''
+        self.start()
+        for harvester in harvesters:
+            self.enqueue(harvester)
+        return await self.finish()
+
+    async def worker(self):
+        while True:
+            task = await self.frontier.get()
+            self.queued -= 1
+            self.in_progress += 1
+            self.harvesters.append(task.harvester)
+            start = time.perf_counter()
+            try:
+                if expired(self.deadline):
+                    #the build budget is spent, what is left in the frontier is deferred to a next build
+                    task.harvester.deferred = True
+                    self.deferred += 1
+                    self.incomplete_entries.add(task.entry)
+                    continue
+                #only the time spent on the documents of an entry counts, not the time they waited in the frontier
+                entry_deadline = time.monotonic() + self.entry_timeout - self.entry_time.get(task.entry, 0.0) if self.entry_timeout else None
+                deadline = earliest(self.deadline, entry_deadline)
+                #asyncio.to_thread copies the context, so the requests of the harvester are counted for the entry and run under its deadline
+                with get_metrics().entry(task.entry), deadline_at(deadline):
+                    await asyncio.to_thread(task.harvester.harvest_entry)
+                    get_metrics().count("documents_harvested")
+                self.harvested += 1
+                for child in task.harvester.children:
+                    self.enqueue(child, parent=task.harvester, entry=task.entry)
+            except DeadlineExceeded as e:
+                logger.warning(f"Stopped harvesting {task.harvester.entry_uri} (depth {task.depth}): {e}")
+                task.harvester.harvest_error = e
+                self.failed += 1
+                self.incomplete_entries.add(task.entry)
+            except Exception as e:
+                logger.error(f"Error harvesting {task.harvester.entry_uri} (depth {task.depth}): {e}")
+                logger.exception(e)
+                task.harvester.harvest_error = e
+                self.failed += 1
+            finally:
+                elapsed = time.perf_counter() - start
+                self.entry_time[task.entry] = self.entry_time.get(task.entry, 0.0) + elapsed
+                with get_metrics().entry(task.entry):
+                    get_metrics().count("harvest_time", elapsed)
+                self.in_progress -= 1
+                self.frontier.task_done()
+            if (self.harvested + self.failed) % PROGRESS_INTERVAL == 0:
+                logger.info(f"Crawl progress: {self.progress()}")
@@ -0,0 +1,76 @@
+#this file will contain the discovery and the reading of the registry csv files in the data folder
+#the data folder is a copy of the repository that runs the action, including its .git folder, so directories that
+#can not hold registry csv files are pruned instead of walked. The rows are read one at a time, so the csv files
+#never have to be loaded as a whole, and a csv file that can not be read does not stop the rows of the other files
+import os
+import csv
+import fnmatch
+from utils.singleton.logger import get_logger
+
+logger = get_logger()
+
+def split_globs(value):
+    return [glob.strip() for glob in value.split(",") if glob.strip()]
+
+#comma separated globs of the paths (relative to the data folder) of the csv files that are read
+DEFAULT_INCLUDE = split_globs(os.environ.get("CSV_INCLUDE", "*.csv"))
+#comma separated globs of the paths that are skipped, a directory is skipped with a glob like docs/*
+DEFAULT_EXCLUDE = split_globs(os.environ.get("CSV_EXCLUDE", ""))
+#comma separated globs of directory names that are never entered, e.g. .git and the other hidden directories
+DEFAULT_PRUNE = split_globs(os.environ.get("CSV_PRUNE_DIRS", ".*,node_modules,__pycache__"))
+#the columns every registry csv file must have
+REQUIRED_COLUMNS = ("URI", "contact")
+
+def matches(path, globs):
+    return any(fnmatch.fnmatchcase(path, glob) for glob in globs)
+
+def scan_files(folder, include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE, prune=DEFAULT_PRUNE):
+    '''
+    find the files in a folder and its subfolders, pruned directories are not entered at all
+    :param folder: the folder to scan
+    :param include: globs of the relative paths of the files to find
+    :param exclude: globs of the relative paths of the files and directories to skip
+    :param prune: globs of the names of the directories to skip
+    :return: generator of the paths of the files, files of a directory in name order before its subdirectories
+    '''
+    folders = [str(folder)]
+    while folders:
+        directory = folders.pop()
+        try:
+            with os.scandir(directory) as scanner:
+                entries = sorted(scanner, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.warning(f"Could not scan {directory}: {e}")
+            continue
+        subdirectories = []
+        for entry in entries:
+            relative = os.path.relpath(entry.path, folder).replace(os.sep, "/")
+            #symlinked directories are not followed, like os.walk
+            if entry.is_dir(follow_symlinks=False):
+                if not matches(entry.name, prune) and not matches(relative + "/", exclude):
+                    subdirectories.append(entry.path)
+            elif entry.is_file() and matches(relative, include) and not matches(relative, exclude):
+                yield entry.path
+        folders.extend(reversed(subdirectories))
+
+def read_rows(paths, required=REQUIRED_COLUMNS):
+    '''
+    read the rows of csv files one at a time.
+    A file that can not be read or misses a required column is logged and skipped, the other files are still read
+    :param paths: the paths of the csv files
+    :param required: the columns a file must have
+    :return: generator of (path, line number, row) with the row as a dict of column to value
+    '''
+    for path in paths:
+        logger.info(f"Reading csv file {path}")
+        try:
+            with open(path, newline='') as csvfile:
+                reader = csv.DictReader(csvfile)
+                missing = [column for column in required if column not in (reader.fieldnames or [])]
+                if missing:
+                    raise ValueError(f"missing column(s) {', '.join(missing)}")
+                for row in reader:
+                    yield path, reader.line_num, row
+        except (OSError, ValueError, csv.Error) as e:
+            #UnicodeDecodeError is a ValueError, the rows read before the error are kept
+            logger.error(f"Error while reading csv file {path}: {e}")
@@ -0,0 +1,81 @@
+#this file will contain the deadlines of a build: a time budget for the whole build and a deadline per registry entry
+#the deadline of the running code is kept in a ContextVar like the current entry of the metrics, so it follows the entry
+#into asyncio tasks and asyncio.to_thread workers. The http client caps its timeouts with the time that is left and
+#refuses to start requests after the deadline, so one slow host can not hold up the build
+import os
+import time
+import contextlib
+import contextvars
+
+#seconds the check and the harvest of the build may take, entries that are not reached in time are deferred, 0 is no budget
+DEFAULT_BUILD_BUDGET = float(os.environ.get("BUILD_TIME_BUDGET", 0))
+#seconds the harvest of an entry and everything it links to may take, 0 is no deadline
+DEFAULT_ENTRY_TIMEOUT = float(os.environ.get("HARVEST_ENTRY_TIMEOUT", 300))
+
+#time.monotonic() time the running code has to be done by, None when there is no deadline
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+class DeadlineExceeded(TimeoutError):
+    '''
+    raised when work is started after the deadline it runs under
+    '''
+
+def deadline_after(seconds):
+    '''
+    :param seconds: the number of seconds from now, 0 or None for no deadline
+    :return: the time.monotonic() time of the deadline or None
+    '''
+    return time.monotonic() + seconds if seconds else None
+
+def earliest(*deadlines):
+    '''
+    the earliest of deadlines, None (no deadline) when none of them is set
+    '''
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
+    return min(deadlines) if deadlines else None
+
+@contextlib.contextmanager
+def deadline_at(deadline):
+    '''
+    run code under a deadline, a deadline that is already running and earlier stays in effect
+    :param deadline: time.monotonic() time or None for no extra deadline
+    '''
+    token = current_deadline.set(earliest(current_deadline.get(), deadline))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+def remaining(deadline=None):
+    '''
+    :param deadline: time.monotonic() time, the current deadline when not given
+    :return: the seconds left until the deadline (negative when it passed) or None when there is no deadline
+    '''
+    deadline = deadline if deadline is not None else current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def expired(deadline=None):
+    left = remaining(deadline)
+    return left is not None and left <= 0
+
+def check_deadline(what):
+    '''
+    raise DeadlineExceeded when the current deadline passed
+    :param what: description of the work that would be started, for the error message
+    '''
+    if expired():
+        raise DeadlineExceeded(f"deadline passed before {what}")
+
+def cap_timeout(timeout):
+    '''
+    cap a requests timeout with the time left until the current deadline
+    :param timeout: a timeout in seconds or a (connect, read) tuple
+    :return: the timeout, with every part at most the time that is left
+    '''
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(left, 0.001)
+    if isinstance(timeout, tuple):
+        return tuple(left if part is None else min(part, left) for part in timeout)
+    return left if timeout is None else min(timeout, left)
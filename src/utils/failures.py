@@ -0,0 +1,136 @@
+#this file will contain the tracking of failing uris and hosts for the http cache
+#a uri whose request failed (connection error, timeout or 5xx after the retries of the rate limiter) is not requested
+#again for FAILED_URI_TTL seconds, also not by the next build as the failures are stored next to the http cache.
+#A host that fails CIRCUIT_BREAKER_THRESHOLD requests in a row gets an open circuit: its requests fail fast
+#until CIRCUIT_BREAKER_COOLDOWN seconds have passed, then one request is let through to see if the host is back.
+#Open circuits are stored as well, so a host that was down during the previous build costs one request
+import os
+import json
+import time
+import threading
+from urllib.parse import urlsplit
+from utils.singleton.logger import get_logger
+from utils.instrumentation import get_metrics
+
+logger = get_logger()
+
+FAILURES_FILE = "failures.json"
+#seconds a failed uri is not requested again, 0 only keeps the circuits of the hosts
+DEFAULT_FAILED_URI_TTL = float(os.environ.get("FAILED_URI_TTL", 3600))
+#number of failed requests in a row after which the requests to a host fail fast, 0 never opens a circuit
+DEFAULT_CIRCUIT_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_THRESHOLD", 5))
+#seconds the circuit of a host stays open before a request is tried again
+DEFAULT_CIRCUIT_COOLDOWN = float(os.environ.get("CIRCUIT_BREAKER_COOLDOWN", 300))
+
+class UriUnavailable(ConnectionError):
+    '''
+    raised instead of requesting a uri that failed recently or whose host has an open circuit
+    '''
+
+class FailureTracker():
+    def __init__(self, directory, ttl=DEFAULT_FAILED_URI_TTL, threshold=DEFAULT_CIRCUIT_THRESHOLD, cooldown=DEFAULT_CIRCUIT_COOLDOWN):
+        self.path = os.path.join(directory, FAILURES_FILE)
+        self.ttl = ttl
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failed_uris = {} #uri to {"reason", "failed"} of the uris that failed within the ttl
+        self.hosts = {} #host to {"errors": failed requests in a row, "opened": time.time() the circuit opened or None}
+        self.rejected = {} #uri to the reason its last request failed fast during this build
+        self.load()
+
+    def __repr__(self) -> str:
+        return f"FailureTracker(failed_uris={len(self.failed_uris)}, open_circuits={sum(1 for host in self.hosts.values() if host['opened'] is not None)})"
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        self.failed_uris = {uri: failure for uri, failure in stored.get("uris", {}).items() if now - failure["failed"] < self.ttl}
+        self.hosts = {host: state for host, state in stored.get("hosts", {}).items() if state["opened"] is not None}
+
+    def save(self):
+        #callers hold the lock
+        open_circuits = {host: state for host, state in self.hosts.items() if state["opened"] is not None}
+        with open(self.path, "w") as f:
+            json.dump({"uris": self.failed_uris, "hosts": open_circuits}, f)
+
+    def host(self, uri):
+        #callers hold the lock
+        return self.hosts.setdefault(urlsplit(str(uri)).netloc, {"errors": 0, "opened": None})
+
+    def check(self, uri):
+        '''
+        fail fast for a uri that failed recently or whose host has an open circuit
+        :param uri: the uri that is about to be requested
+        :raises UriUnavailable: when the uri should not be requested
+        '''
+        host_name = urlsplit(str(uri)).netloc
+        with self.lock:
+            failure = self.failed_uris.get(uri)
+            if failure is not None and time.time() - failure["failed"] < self.ttl:
+                reason = f"{uri} failed {int(time.time() - failure['failed'])}s ago: {failure['reason']}"
+                get_metrics().count("failed_uri_hits", host=host_name)
+                self.rejected[uri] = reason
+                raise UriUnavailable(reason)
+            host = self.host(uri)
+            if host["opened"] is not None:
+                if time.time() - host["opened"] < self.cooldown:
+                    reason = f"host {host_name} is unavailable after {host['errors']} failed requests in a row"
+                    get_metrics().count("circuit_rejections", host=host_name)
+                    self.rejected[uri] = reason
+                    raise UriUnavailable(reason)
+                #half open, this request is let through and the others keep failing fast until it is answered
+                host["opened"] = time.time()
+
+    def failed(self, uri, reason):
+        '''
+        record a failed request, the uri is remembered and the host gets an open circuit after threshold failures in a row
+        :param uri: the uri of the request
+        :param reason: why it failed, e.g. the exception or the status code
+        '''
+        with self.lock:
+            if self.ttl > 0:
+                self.failed_uris[uri] = {"reason": str(reason), "failed": time.time()}
+            host = self.host(uri)
+            host["errors"] += 1
+            if self.threshold and host["errors"] >= self.threshold and host["opened"] is None:
+                host["opened"] = time.time()
+                get_metrics().count("circuits_opened", host=urlsplit(str(uri)).netloc)
+                logger.warning(f"Requests to {urlsplit(str(uri)).netloc} fail fast for {self.cooldown}s after {host['errors']} failed requests in a row")
+            self.save()
+
+    def succeeded(self, uri):
+        '''
+        record a request that was answered, the host is available again
+        '''
+        with self.lock:
+            host = self.host(uri)
+            closed = host["opened"] is not None
+            host["errors"] = 0
+            host["opened"] = None
+            self.rejected.pop(uri, None)
+            if self.failed_uris.pop(uri, None) is not None or closed:
+                self.save()
+
+    def answered(self, uri, response):
+        '''
+        record the response of a request, server errors count as failures
+        '''
+        if response.status_code >= 500:
+            self.failed(uri, f"HTTP {response.status_code}")
+        else:
+            self.succeeded(uri)
+
+    def reason(self, uri):
+        '''
+        :return: why the last request of a uri failed or was not done, None when it did not fail
+        '''
+        with self.lock:
+            if uri in self.rejected:
+                return self.rejected[uri]
+            failure = self.failed_uris.get(uri)
+            return None if failure is None else failure["reason"]
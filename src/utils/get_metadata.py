@@ -1,15 +1,16 @@
 #this utility file will help with getting metadata from a given uri
 
-import requests
 import json
-import rdflib
 import os
 import sys
-import time
 import re
-#from utils.singleton.logger import get_logger
+from utils.httpcache import cached_get
+from utils.lazy_import import lazy_import
+from utils.html_head import describedby_links
+from utils.singleton.logger import get_logger
 
-#logger = get_logger()
+logger = get_logger()
+rdflib = lazy_import("rdflib")
 
 #class here that will handle all actions related to a given uri
 class Metadata():
@@ -40,8 +41,7 @@ class Metadata():
         mime_types = ["application/json", "application/rdf+xml", "application/rdf+json", "application/ld+json", "text/turtle"]
         for mime_type in mime_types:
             try:
-                response = requests.get(self.uri, headers={"Accept": mime_type})
-                time.sleep(0.3)
+                response = cached_get(self.uri, headers={"Accept": mime_type})
                 print("trying to get metadata from uri {0} with mimetype {1}".format(self.uri, mime_type))
                 if response.status_code == 200:
                     print("content type: {0}".format(response.headers["Content-Type"]))
@@ -59,30 +59,21 @@ class Metadata():
             
         if "mimetype" not in self.metadata:
             try:
-                response = requests.get(self.uri)
+                response = cached_get(self.uri)
                 #print(response.text)
                 if response.status_code == 200:
                     #perform search with regex to find the link with rel=describedby in the html head section of the uri
                     #if there is a link then get then set href to self.uri and self.uri_change to True and also check if the type is one of the mime_types
                     #if there is no link then set self.uri to self.uri+ro-crate-metadata.json and self.uri_change to True
-                    #split the response text into lines and then search each line for the link with rel=describedby
-                    for line in response.text.split("<link"):
-                        lin_elemets = line.split("/>")
-                        for element in lin_elemets:
-                            if "rel=describedby" in element:
-                                print(element)
-                                #get the href from the element and then check if the href is a full uri or a relative uri
-                                self.uri_change = True
-                                if self.uri[-1] == "/":
-                                    self.uri = self.uri + element.split("href=")[1].split(" ")[0].replace('"', '')[2:]
-                                else:
-                                    self.uri = self.uri + element.split("href=")[1].split(" ")[0].replace('"', '')[1:]
-                                #check if type is in element
-                                if "type=" in element:
-                                    type = element.split("type=")[1].split(" ")[0].replace('"', '')
-                                    if type in mime_types:
-                                        self.metadata["mimetype"] = type
-                                        break
+                    #the links come from the Link header and the html head, relative hrefs are resolved against the uri of the page
+                    for href, link_type in describedby_links(response):
+                        logger.debug(f"Following the describedby link {href} of {self.uri}")
+                        self.uri_change = True
+                        self.uri = href
+                        #check if type is in element
+                        if link_type in mime_types:
+                            self.metadata["mimetype"] = link_type
+                        break
                     
                     if not self.uri_change:
                         #if uri ends with ro-crate-metadata.json then set self.uri_change to False
@@ -102,12 +93,14 @@ class Metadata():
     def is_error(self):
         return self.error
                 
-test = Metadata("https://data.arms-mbon.org/")
-print(test.metadata)
-print(test.uri)
-print(test.uri_change)
+#only when the file is run on its own, importing it must not fetch anything
+if __name__ == "__main__":
+    test = Metadata("https://data.arms-mbon.org/")
+    print(test.metadata)
+    print(test.uri)
+    print(test.uri_change)
 
-test2 = Metadata("https://cedricdcc.github.io/test_single_rocrate/latest/")
-print(test2.metadata)
-print(test2.uri)
-print(test2.uri_change)
\ No newline at end of file
+    test2 = Metadata("https://cedricdcc.github.io/test_single_rocrate/latest/")
+    print(test2.metadata)
+    print(test2.uri)
+    print(test2.uri_change)
\ No newline at end of file
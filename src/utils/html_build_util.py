@@ -1,17 +1,32 @@
 #file that contains function to help build and clean build folder
+#the templates are rendered by one shared jinja Environment that keeps the compiled templates in a bytecode cache
+#the ShardWriter writes the pages of the site and skips the pages whose template and data did not change since the previous build
 
 import os
 import sys
+import json
 import shutil
+import hashlib
+import threading
 from utils.singleton import location
 from utils.singleton.logger import get_logger
-from jinja2 import Template
+from utils.httpcache import DEFAULT_CACHE_DIR
+from utils.instrumentation import get_metrics
+from utils.lazy_import import lazy_import
 
 logger = get_logger()
+jinja2 = lazy_import("jinja2")
 
-def setup_build_folder():
+#compiled templates are kept next to the http cache so they survive between runs
+DEFAULT_JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR", os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), "jinja"))
+#file with the pages that were written and the digest of what they were rendered from, it is kept next to the http cache
+#like the compiled templates, the build folder is published with the site and does not survive between action runs
+DEFAULT_SHARDS_FILE = os.environ.get("HTML_SHARDS_FILE", os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), "shards.json"))
+
+def setup_build_folder(keep=()):
     '''
     this function will setup the build folder
+    :param keep: names of files and folders in the build folder that are not removed, e.g. pages that are only rewritten when they changed
     '''
     # check if the build folder exists
     logger.info("Setting up build folder")
@@ -20,11 +35,13 @@ def setup_build_folder():
         os.mkdir(os.path.join(location.Location().get_location(), "build"))
     else:
         # if it exists, clean it
-        clean_build_folder()
+        clean_build_folder(keep=keep)
         
-def clean_build_folder():
+def clean_build_folder(keep=()):
     if os.path.isdir(os.path.join(location.Location().get_location(), "build")):
         for file in os.listdir(os.path.join(location.Location().get_location(), "build")):
+            if file in keep:
+                continue
             try:
                 shutil.rmtree(os.path.join(os.path.join(location.Location().get_location(), "build"), file))
             except NotADirectoryError:
@@ -57,11 +74,99 @@ def make_html_file(template_file, **kwargs):
         sys.exit(1)
     # read the template file
     try:
-        template = Template(open(os.path.join(location.Location().get_location(), "templates", template_file)).read())
+        template = get_environment().get_template(template_file)
         # render the template file
         html = template.render(**kwargs)
     except Exception as e:
         logger.error("Error rendering template file: {}".format(e))
         logger.debug("Error rendering template file: {}".format(e), exc_info=True)
         sys.exit(1)
-    return html
\ No newline at end of file
+    return html
+
+_environment = None
+_environment_lock = threading.Lock()
+
+def get_environment():
+    '''
+    get the shared jinja environment of the templates folder, it is made on first use
+    '''
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            os.makedirs(DEFAULT_JINJA_CACHE_DIR, exist_ok=True)
+            _environment = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(os.path.join(location.Location().get_location(), "templates")),
+                bytecode_cache=jinja2.FileSystemBytecodeCache(DEFAULT_JINJA_CACHE_DIR),
+            )
+        return _environment
+
+class ShardWriter():
+    '''
+    writes the pages (shards) of the site into the build folder.
+    A page is only rendered and written when its template or its data changed since the previous build,
+    pages of the previous build that are not written again are removed by finish
+    '''
+    def __init__(self, folder, shards_file=DEFAULT_SHARDS_FILE):
+        self.folder = folder
+        self.shards_file = shards_file
+        self.previous = self.load()
+        self.shards = {}
+        self.template_digests = {}
+        self.written = 0
+        self.skipped = 0
+
+    def __repr__(self) -> str:
+        return f"ShardWriter(folder={self.folder}, written={self.written}, skipped={self.skipped})"
+
+    def load(self):
+        try:
+            with open(self.shards_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def template_digest(self, template_file):
+        if template_file not in self.template_digests:
+            source, _, _ = get_environment().loader.get_source(get_environment(), template_file)
+            self.template_digests[template_file] = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        return self.template_digests[template_file]
+
+    def write(self, path, template_file=None, **kwargs):
+        '''
+        render a template into a page of the build folder, unless the page is already there with the same template and data
+        :param path: the path of the page relative to the build folder
+        :param template_file: the template to render, None writes kwargs as compact json
+        :param kwargs: the arguments to pass to the template file
+        '''
+        data = json.dumps(kwargs, sort_keys=True, default=str)
+        digest = hashlib.sha256("{0}\n{1}".format(self.template_digest(template_file) if template_file else "json", data).encode("utf-8")).hexdigest()
+        self.shards[path] = digest
+        destination = os.path.join(self.folder, path)
+        if self.previous.get(path) == digest and os.path.isfile(destination):
+            self.skipped += 1
+            return
+        if template_file:
+            content = get_environment().get_template(template_file).render(**kwargs)
+        else:
+            content = json.dumps(kwargs, separators=(",", ":"), default=str)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, "w") as f:
+            f.write(content)
+        self.written += 1
+
+    def finish(self):
+        '''
+        remove the pages of the previous build that were not written by this build and save the list of pages
+        '''
+        for path in self.previous:
+            if path not in self.shards:
+                try:
+                    os.remove(os.path.join(self.folder, path))
+                except FileNotFoundError:
+                    pass
+        os.makedirs(os.path.dirname(self.shards_file), exist_ok=True)
+        with open(self.shards_file, "w") as f:
+            json.dump(self.shards, f, indent=1)
+        get_metrics().count("html_pages_written", self.written)
+        get_metrics().count("html_pages_skipped", self.skipped)
+        logger.info(f"Wrote {self.written} pages, {self.skipped} pages did not change")
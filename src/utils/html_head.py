@@ -0,0 +1,119 @@
+#this file will contain the discovery of describedby links in the Link header and the html head of a response
+#the html is parsed with html.parser in chunks and only up to </head> (or the start of the body) or HTML_HEAD_MAX_BYTES,
+#so a big landing page is never parsed as a whole. The body is still downloaded as a whole, it is cached and hashed like every
+#other document. Relative hrefs are resolved against the url the response came from
+import os
+import codecs
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from utils.singleton.logger import get_logger
+from utils.lazy_import import lazy_import
+
+logger = get_logger()
+requests_utils = lazy_import("requests.utils")
+
+#maximum number of bytes of a html page that are scanned for the head
+MAX_HEAD_BYTES = int(os.environ.get("HTML_HEAD_MAX_BYTES", 256 * 1024))
+CHUNK_SIZE = 16 * 1024
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+class HeadScanner(HTMLParser):
+    '''
+    collects the <link> and <base> elements of a html head, done is set once the head is over
+    '''
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = [] #the attributes of every <link> element as a dict
+        self.base = None #the href of the <base> element
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "link":
+            attrs = self.strip_self_closing(attrs)
+            self.links.append({name.lower(): value for name, value in attrs if value is not None})
+        elif tag == "base" and self.base is None:
+            self.base = dict(attrs).get("href")
+        elif tag == "body":
+            self.done = True
+
+    def strip_self_closing(self, attrs):
+        #an unquoted last value keeps the / of a self closing tag, e.g. type=application/ld+json/> gives application/ld+json/
+        text = self.get_starttag_text() or ""
+        if not attrs or not attrs[-1][1] or not text.endswith("/>"):
+            return attrs
+        name, value = attrs[-1]
+        if value.endswith("/") and text[:-1].endswith(value):
+            return attrs[:-1] + [(name, value[:-1])]
+        return attrs
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.done = True
+
+def iter_chunks(content, size=CHUNK_SIZE):
+    '''
+    split a body that is already read into chunks, like iter_content does for a streamed response
+    '''
+    for start in range(0, len(content), size):
+        yield content[start:start + size]
+
+def scan_head(chunks, encoding=None, max_bytes=MAX_HEAD_BYTES):
+    '''
+    scan the head of a html document
+    :param chunks: iterable of bytes, e.g. iter_chunks(response.content) or response.iter_content(CHUNK_SIZE) of a streamed response
+    :param encoding: the encoding of the document, utf-8 when not known
+    :param max_bytes: the number of bytes after which the scan stops when the head did not end yet
+    :return: the HeadScanner with the links and the base of the head
+    '''
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    scanner = HeadScanner()
+    read = 0
+    for chunk in chunks:
+        chunk = chunk[:max_bytes - read]
+        read += len(chunk)
+        scanner.feed(decoder.decode(chunk))
+        if scanner.done:
+            break
+        if read >= max_bytes:
+            logger.debug(f"Stopped scanning html for its head after {read} bytes")
+            break
+    return scanner
+
+def has_rel(rel, name):
+    #rel is a space separated list of link relations, compared case-insensitively
+    return name in (rel or "").lower().split()
+
+def parse_link_header(value):
+    '''
+    parse a HTTP Link header
+    :param value: the value of the header
+    :return: list of dicts with the url and the parameters (rel, type, ...) of every link
+    '''
+    if not value:
+        return []
+    return requests_utils.parse_header_links(value)
+
+def describedby_links(response, max_bytes=MAX_HEAD_BYTES):
+    '''
+    find the describedby links of a response, first in its Link header and then in the head of its html
+    :param response: the response
+    :param max_bytes: the number of bytes of the html that are scanned at most
+    :return: list of (absolute uri, mime type or None) in the order they were found
+    '''
+    links = []
+    for link in parse_link_header(response.headers.get("Link")):
+        if has_rel(link.get("rel"), "describedby") and link.get("url"):
+            links.append((urljoin(response.url, link["url"]), link.get("type")))
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if response.status_code == 200 and content_type in HTML_TYPES:
+        head = scan_head(iter_chunks(response.content), response.encoding, max_bytes)
+        base = urljoin(response.url, head.base) if head.base else response.url
+        for link in head.links:
+            if has_rel(link.get("rel"), "describedby") and link.get("href"):
+                links.append((urljoin(base, link["href"].strip()), link.get("type")))
+    return links
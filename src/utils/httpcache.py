@@ -0,0 +1,346 @@
+#this file will contain the on-disk http cache that is shared by all the http calls
+#responses are stored per uri and Accept header together with their validators (ETag/Last-Modified)
+#and are revalidated with a conditional GET, so an unchanged document only costs a 304
+#within one build every uri and Accept header is fetched at most once, later calls are answered from memory or from the disk
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from utils.singleton.location import singleton
+from utils.singleton.logger import get_logger
+from utils.ratelimiter import rate_limited_get
+from utils.instrumentation import get_metrics
+from utils.lazy_import import lazy_import
+from utils.failures import FailureTracker
+from utils.deadlines import expired
+
+logger = get_logger()
+requests = lazy_import("requests")
+structures = lazy_import("requests.structures")
+
+#the cache directory can be kept between github action runs by pointing HTTP_CACHE_DIR to a cached folder
+DEFAULT_CACHE_DIR = os.environ.get(
+    "HTTP_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "http")
+)
+DEFAULT_MAX_SIZE = int(os.environ.get("HTTP_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+#seconds between saves of the lru index while it changes, it is always saved at the end of a build by flush
+INDEX_SAVE_INTERVAL = float(os.environ.get("HTTP_CACHE_INDEX_SAVE_INTERVAL", 60))
+#bytes of the bodies fetched during a build that are kept in memory, the least recently used are read back from the disk when needed again
+DEFAULT_MEMORY_SIZE = int(os.environ.get("HTTP_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+#folder in the cache directory for the bodies without validators that were dropped from memory, it only lasts one build
+SPILL_FOLDER = "spill"
+
+#headers that describe the transfer and not the stored (already decoded) body
+TRANSFER_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection")
+
+@singleton
+class HttpCache():
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, memory_size=DEFAULT_MEMORY_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self.lock = threading.Lock()
+        #responses fetched during this build and a lock per key so the same key is never fetched twice at the same time
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.fetched = set() #keys fetched during this build that were dropped from memory, they are read from the disk without revalidating
+        self.spilled = set() #keys fetched during this build that are not in the cache, they were dropped from memory into the spill folder
+        self.key_locks = defaultdict(threading.Lock)
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self.load_index()
+        self.dirty = False #the lru order or the entries of the index changed since it was saved
+        self.saved = time.monotonic()
+        #failed uris and hosts fail fast instead of being requested again, see utils.failures
+        self.failures = FailureTracker(self.directory)
+        self.size = sum(self.index.values())
+
+    def __repr__(self) -> str:
+        return f"HttpCache(directory={self.directory}, entries={len(self.index)}, size={self.size})"
+
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def load_index(self):
+        '''
+        load the lru index, the first key is the least recently used entry
+        :return: OrderedDict of cache key to body size
+        '''
+        try:
+            with open(self.index_path()) as f:
+                index = OrderedDict(json.load(f))
+        except (OSError, ValueError):
+            return OrderedDict()
+        #drop the entries whose files have gone missing
+        for key in list(index):
+            if not os.path.isfile(self.path(key, "json")):
+                del index[key]
+        return index
+
+    def save_index(self, force=False):
+        '''
+        write the lru index when it changed, at most once every INDEX_SAVE_INTERVAL seconds unless forced
+        callers hold the lock
+        '''
+        if not self.dirty or (not force and time.monotonic() - self.saved < INDEX_SAVE_INTERVAL):
+            return
+        with open(self.index_path(), "w") as f:
+            json.dump(list(self.index.items()), f)
+        self.dirty = False
+        self.saved = time.monotonic()
+
+    def clear_memory(self):
+        '''
+        forget the responses fetched by the previous build, so a new build in the same process revalidates them
+        '''
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            self.fetched.clear()
+            self.spilled.clear()
+            self.key_locks.clear()
+            shutil.rmtree(os.path.join(self.directory, SPILL_FOLDER), ignore_errors=True)
+
+    def flush(self):
+        '''
+        save the lru index if it changed, called once at the end of a build
+        '''
+        with self.lock:
+            self.save_index(force=True)
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    @staticmethod
+    def key(uri, accept=None):
+        return hashlib.sha256(f"{uri}\n{accept or ''}".encode("utf-8")).hexdigest()
+
+    def read(self, key):
+        '''
+        read a cached response
+        :param key: the cache key
+        :return: tuple of (meta dict, body bytes) or None when the key is not cached
+        '''
+        with self.lock:
+            if key not in self.index:
+                return None
+            try:
+                with open(self.path(key, "json")) as f:
+                    meta = json.load(f)
+                with open(self.path(key, "body"), "rb") as f:
+                    body = f.read()
+            except (OSError, ValueError):
+                self.remove(key)
+                return None
+            self.index.move_to_end(key)
+            self.dirty = True
+            return meta, body
+
+    def store(self, key, response):
+        '''
+        store a response with its headers and validators and evict the least recently used entries when over max_size
+        :param key: the cache key
+        :param response: the requests.Response to store
+        '''
+        body = response.content
+        if len(body) > self.max_size:
+            return
+        meta = to_meta(response)
+        with self.lock:
+            self.remove(key)
+            with open(self.path(key, "body"), "wb") as f:
+                f.write(body)
+            with open(self.path(key, "json"), "w") as f:
+                json.dump(meta, f)
+            self.index[key] = len(body)
+            self.size += len(body)
+            while self.size > self.max_size and len(self.index) > 1:
+                self.remove(next(iter(self.index)))
+            self.dirty = True
+            self.save_index()
+
+    def update_headers(self, key, meta, response):
+        '''
+        merge the headers of a 304 response into the stored meta, the validators can be refreshed by the server
+        '''
+        for name, value in response.headers.items():
+            if name.lower() not in TRANSFER_HEADERS:
+                meta["headers"][name] = value
+        with self.lock:
+            if key in self.index:
+                with open(self.path(key, "json"), "w") as f:
+                    json.dump(meta, f)
+
+    def remember(self, key, response):
+        '''
+        keep a response fetched during this build in memory, the least recently used are dropped when over memory_size
+        '''
+        with self.lock:
+            self.memory[key] = (to_meta(response), response.content)
+            self.memory_bytes += len(response.content)
+            while self.memory_bytes > self.memory_size and len(self.memory) > 1:
+                dropped, (meta, body) = self.memory.popitem(last=False)
+                self.memory_bytes -= len(body)
+                if dropped in self.index:
+                    self.fetched.add(dropped)
+                else:
+                    #no validators so it is not in the cache, it is kept for the rest of the build
+                    self.spill(dropped, meta, body)
+
+    def spill(self, key, meta, body):
+        #callers hold the lock
+        folder = os.path.join(self.directory, SPILL_FOLDER)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"{key}.body"), "wb") as f:
+            f.write(body)
+        with open(os.path.join(folder, f"{key}.json"), "w") as f:
+            json.dump(meta, f)
+        self.spilled.add(key)
+
+    def read_spilled(self, key):
+        '''
+        read a response that was dropped from memory into the spill folder
+        :return: tuple of (meta dict, body bytes) or None when it can not be read
+        '''
+        folder = os.path.join(self.directory, SPILL_FOLDER)
+        try:
+            with open(os.path.join(folder, f"{key}.json")) as f:
+                meta = json.load(f)
+            with open(os.path.join(folder, f"{key}.body"), "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None
+
+    def recall(self, key):
+        '''
+        get a response fetched during this build
+        :return: tuple of (meta dict, body bytes) or None when the key was not fetched or is no longer cached
+        '''
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                get_metrics().count("cache_memory_hits")
+                return self.memory[key]
+            fetched = key in self.fetched
+            spilled = key in self.spilled
+        if spilled:
+            return self.read_spilled(key)
+        return self.read(key) if fetched else None
+
+    def remove(self, key):
+        #callers hold the lock
+        self.size -= self.index.pop(key, 0)
+        self.dirty = True
+        for extension in ("json", "body"):
+            try:
+                os.remove(self.path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def get(self, uri, headers=None, **kwargs):
+        '''
+        do a GET request, revalidating a cached response with If-None-Match/If-Modified-Since when there is one
+        :param uri: the uri to get
+        :param headers: the request headers, the Accept header is part of the cache key
+        :param kwargs: extra arguments passed on to the http client
+        :return: the response, rebuilt from the cache when the server answered 304
+        '''
+        headers = dict(headers or {})
+        key = self.key(uri, headers.get("Accept"))
+        with self.lock:
+            key_lock = self.key_locks[key]
+        get_metrics().count("cache_lookups")
+        with key_lock:
+            cached = self.recall(key)
+            if cached is not None:
+                logger.debug(f"HTTP hit for {uri}, it was already fetched during this build")
+                get_metrics().count("cache_hits")
+                return to_response(*cached)
+            response = self.fetch(key, uri, headers, **kwargs)
+            if response.status_code == 200:
+                self.remember(key, response)
+            return response
+
+    def fetch(self, key, uri, headers, **kwargs):
+        '''
+        fetch a uri, revalidating the response stored on disk when there is one
+        :raises UriUnavailable: when the uri failed recently or its host has an open circuit
+        '''
+        cached = self.read(key)
+        if cached is not None:
+            meta, body = cached
+            stored_headers = structures.CaseInsensitiveDict(meta["headers"])
+            if "ETag" in stored_headers:
+                headers["If-None-Match"] = stored_headers["ETag"]
+            if "Last-Modified" in stored_headers:
+                headers["If-Modified-Since"] = stored_headers["Last-Modified"]
+        self.failures.check(uri)
+        try:
+            response = rate_limited_get(uri, headers=headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            #a request that was cut short by the deadline of the build says nothing about the host
+            if not expired():
+                self.failures.failed(uri, e)
+            raise
+        self.failures.answered(uri, response)
+        if response.status_code == 304 and cached is not None:
+            logger.debug(f"HTTP cache hit for {uri}")
+            get_metrics().count("cache_hits")
+            get_metrics().count("cache_revalidated")
+            self.update_headers(key, meta, response)
+            return to_response(meta, body)
+        if response.status_code == 200 and is_cacheable(response):
+            self.store(key, response)
+        return response
+
+def is_cacheable(response):
+    '''
+    a response is only worth storing when it can be revalidated later
+    '''
+    if "no-store" in response.headers.get("Cache-Control", ""):
+        return False
+    return "ETag" in response.headers or "Last-Modified" in response.headers
+
+def to_meta(response):
+    '''
+    the part of a response that is stored next to the body
+    '''
+    return {
+        "url": response.url,
+        "status_code": response.status_code,
+        "encoding": response.encoding,
+        "headers": {k: v for k, v in response.headers.items() if k.lower() not in TRANSFER_HEADERS},
+        "stored": time.time(),
+    }
+
+def to_response(meta, body):
+    '''
+    rebuild a requests.Response from a cached entry so callers can not tell the difference
+    '''
+    response = requests.Response()
+    response.status_code = meta["status_code"]
+    response.reason = "OK"
+    response.url = meta["url"]
+    response.encoding = meta["encoding"]
+    response.headers = structures.CaseInsensitiveDict(meta["headers"])
+    response._content = body
+    return response
+
+def failure_reason(uri):
+    '''
+    :return: why the last request of a uri failed or was not done, None when it did not fail
+    '''
+    return HttpCache().failures.reason(uri)
+
+def cached_get(uri, headers=None, **kwargs):
+    '''
+    do a GET request through the shared http cache and rate limiter
+    :param uri: the uri to get
+    :param headers: the request headers
+    :param kwargs: extra arguments passed on to the http client
+    :return: the response
+    '''
+    return HttpCache().get(uri, headers=headers, **kwargs)
@@ -0,0 +1,119 @@
+#this file will contain the http client that does the actual requests for the cache and the rate limiter
+#one requests.Session is shared so connections to the same host are kept alive and reused
+#the client can be replaced with set_http_client, e.g. to point the harvesters at a local stub server
+import os
+import threading
+from utils.singleton.logger import get_logger
+from utils.lazy_import import lazy_import
+from utils.deadlines import check_deadline, cap_timeout
+
+logger = get_logger()
+requests = lazy_import("requests")
+adapters = lazy_import("requests.adapters")
+urllib3_exceptions = lazy_import("urllib3.exceptions")
+
+#number of hosts to keep a connection pool for and number of connections per host
+DEFAULT_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 32))
+DEFAULT_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 4))
+#connect and read timeout in seconds
+DEFAULT_TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5)),
+    float(os.environ.get("HTTP_READ_TIMEOUT", 30)),
+)
+#maximum number of http redirects that are followed for one request
+DEFAULT_MAX_REDIRECTS = int(os.environ.get("HTTP_MAX_REDIRECTS", 10))
+#bytes read at a time from a response body, the deadline is checked between the chunks
+CHUNK_SIZE = 64 * 1024
+USER_AGENT = "profile-registry-harvester (+https://github.com/cedricdcc/test-profile-repository)"
+
+class HttpClient():
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, max_redirects=DEFAULT_MAX_REDIRECTS):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.session.max_redirects = max_redirects
+        #pool_block makes pool_maxsize a hard limit of open connections per host
+        #the adapter does not retry, failed connections and 429/503 responses are only retried by the rate limiter,
+        #so a request takes at most RATE_LIMIT_MAX_RETRIES + 1 attempts
+        adapter = adapters.HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __repr__(self) -> str:
+        return f"HttpClient(timeout={self.timeout})"
+
+    def get(self, uri, **kwargs):
+        '''
+        do a GET request over the pooled session
+        :param uri: the uri to get
+        :param kwargs: extra arguments passed on to requests.Session.get, the timeout defaults to the client timeout
+        :return: the response, its body is already read
+        :raises DeadlineExceeded: when the deadline of the entry or the build passed, see utils.deadlines
+        '''
+        #no request is started after the deadline and the timeouts are capped with the time that is left
+        check_deadline(f"getting {uri}")
+        kwargs["timeout"] = cap_timeout(kwargs.get("timeout", self.timeout))
+        kwargs["stream"] = True
+        response = self.session.get(uri, **kwargs)
+        #the read timeout only limits the wait for each chunk, so a server that trickles the body is stopped between chunks
+        chunks = []
+        try:
+            for chunk in iter_chunks(response):
+                check_deadline(f"reading {uri}")
+                chunks.append(chunk)
+        except BaseException:
+            #the connection is not handed back to the pool with an unread body
+            response.close()
+            raise
+        response._content = b"".join(chunks)
+        return response
+
+    def close(self):
+        self.session.close()
+
+def iter_chunks(response):
+    '''
+    iterate over the body of a streamed response, a chunk is returned as soon as data arrived instead of once CHUNK_SIZE bytes arrived
+    :param response: a response of a request with stream=True
+    :return: generator of the decoded chunks of the body
+    '''
+    read1 = getattr(response.raw, "read1", None)
+    if read1 is None:
+        #urllib3 1.x waits for a full chunk
+        yield from response.iter_content(CHUNK_SIZE)
+        return
+    try:
+        while chunk := read1(CHUNK_SIZE, decode_content=True):
+            yield chunk
+    except urllib3_exceptions.HTTPError as e:
+        #the same error requests raises for a body that could not be read, so the rate limiter retries it
+        raise requests.ConnectionError(e, request=response.request)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_http_client():
+    '''
+    get the shared http client, it is made on first use
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+def set_http_client(client):
+    '''
+    replace the shared http client, anything with a get(uri, **kwargs) method returning a requests.Response can be used
+    :param client: the new client
+    :return: the previous client
+    '''
+    global _client
+    with _client_lock:
+        previous = _client
+        _client = client
+        return previous
@@ -0,0 +1,227 @@
+#this file will contain the helpers to log expensive payloads (graph dumps, big json) without paying for them when they are not logged
+#payloads are wrapped in a Lazy object that is only turned into a string when the log record is actually emitted
+#graph dumps are written to artifact files instead of the log stream
+#the Metrics class records timings and counters per build stage, entry and host, they are written to build/metrics.json
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+from utils.singleton.location import Location
+
+#folder (relative to the src folder) where the debug artifacts are written
+ARTIFACTS_FOLDER = os.environ.get("ARTIFACTS_FOLDER", "artifacts")
+METRICS_FILE = "metrics.json"
+#path of an optional prometheus textfile (node exporter textfile collector) the metrics are also written to
+PROMETHEUS_FILE = os.environ.get("METRICS_PROMETHEUS_FILE")
+
+#the registry entry that the running code is working for
+current_entry = contextvars.ContextVar("current_entry", default=None)
+#the build stage that the running code belongs to, stages can overlap when they run in different threads or tasks
+current_stage = contextvars.ContextVar("current_stage", default=None)
+
+class Lazy():
+    '''
+    wraps a function and its arguments, the function is only called when the object is formatted
+    e.g. logger.debug("%s", Lazy(json.dumps, data, indent=4))
+    '''
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self) -> str:
+        return f"Lazy({self.function.__name__})"
+
+    def __str__(self):
+        return str(self.function(*self.args, **self.kwargs))
+
+def artifact_name(uri, suffix):
+    '''
+    make a file name for an artifact of a uri that is readable and unique
+    :param uri: the uri the artifact belongs to
+    :param suffix: the file suffix, e.g. kg.ttl
+    :return: the file name
+    '''
+    readable = re.sub(r"[^A-Za-z0-9._-]+", "_", str(uri))[-80:].strip("_")
+    digest = hashlib.sha1(str(uri).encode("utf-8")).hexdigest()[:10]
+    return f"{readable}-{digest}.{suffix}"
+
+def artifacts_path():
+    root = Location().get_location() or os.getcwd()
+    return os.path.join(root, ARTIFACTS_FOLDER)
+
+def write_artifact(logger, name, function, *args, level=logging.DEBUG, **kwargs):
+    '''
+    write the output of function to an artifact file, only when the logger is enabled for the level
+    :param logger: the logger that decides if the artifact is wanted
+    :param name: the file name of the artifact
+    :param function: function that builds the content of the artifact (str or bytes)
+    :param level: the log level the artifact belongs to
+    :return: the path of the artifact or None when it was not written
+    '''
+    if not logger.isEnabledFor(level):
+        return None
+    folder = artifacts_path()
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    content = function(*args, **kwargs)
+    with open(path, "wb" if isinstance(content, bytes) else "w") as f:
+        f.write(content)
+    logger.log(level, "Wrote artifact %s", path)
+    return path
+
+class Metrics():
+    '''
+    counters and timings of a registry build.
+    Every counter is kept in total, for the current build stage, for the current entry and optionally for a host.
+    The current stage is set by Registry.build with stage(), the current entry with entry(), both follow the
+    context into asyncio tasks and asyncio.to_thread workers, see in_context for other threads.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self) -> str:
+        return f"Metrics(stages={list(self.stages)}, entries={len(self.entries)}, hosts={len(self.hosts)})"
+
+    def reset(self):
+        self.started = time.time()
+        self.totals = Counter()
+        self.stages = {}
+        self.entries = {}
+        self.hosts = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        time a build stage, the counters that are counted meanwhile in this context are added to the stage.
+        A stage that is entered more than once adds up the time spent in it
+        '''
+        token = current_stage.set(name)
+        with self.lock:
+            self.stages.setdefault(name, {"duration": 0.0, "counters": Counter()})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages[name]["duration"] += time.perf_counter() - start
+            current_stage.reset(token)
+
+    @contextlib.contextmanager
+    def entry(self, uri):
+        '''
+        add the counters that are counted meanwhile to an entry of the registry
+        '''
+        token = current_entry.set(str(uri))
+        try:
+            yield
+        finally:
+            current_entry.reset(token)
+
+    def count(self, name, value=1, host=None):
+        '''
+        add value to a counter
+        :param name: the name of the counter, e.g. http_requests
+        :param value: the amount to add
+        :param host: the host the value belongs to, if any
+        '''
+        entry = current_entry.get()
+        stage = current_stage.get()
+        with self.lock:
+            self.totals[name] += value
+            if stage is not None:
+                self.stages[stage]["counters"][name] += value
+            if entry is not None:
+                self.entries.setdefault(entry, Counter())[name] += value
+            if host is not None:
+                self.hosts.setdefault(host, Counter())[name] += value
+
+    def report(self):
+        '''
+        get all the metrics as a dict that can be written as json
+        '''
+        with self.lock:
+            return {
+                "started": self.started,
+                "duration": round(time.time() - self.started, 4),
+                "totals": with_rates(self.totals),
+                "stages": {
+                    name: {"duration": round(stage["duration"], 4), **with_rates(stage["counters"])}
+                    for name, stage in self.stages.items()
+                },
+                "entries": {uri: with_rates(counters) for uri, counters in self.entries.items()},
+                "hosts": {host: with_rates(counters) for host, counters in self.hosts.items()},
+            }
+
+    def write(self, folder, prometheus_file=None):
+        '''
+        write the metrics to metrics.json in folder and optionally to a prometheus textfile
+        :param folder: the folder to write metrics.json to, e.g. the build folder
+        :param prometheus_file: path of the prometheus textfile, not written when None
+        :return: the report that was written
+        '''
+        report = self.report()
+        with open(os.path.join(folder, METRICS_FILE), "w") as f:
+            json.dump(report, f, indent=4)
+        if prometheus_file:
+            with open(prometheus_file, "w") as f:
+                f.write(to_prometheus(report))
+        return report
+
+def with_rates(counters):
+    '''
+    the counters as a plain dict with the cache hit rate added when there were cache lookups
+    '''
+    result = {name: round(value, 4) if isinstance(value, float) else value for name, value in sorted(counters.items())}
+    if counters.get("cache_lookups"):
+        result["cache_hit_rate"] = round(counters.get("cache_hits", 0) / counters["cache_lookups"], 4)
+    return result
+
+def to_prometheus(report):
+    '''
+    format a metrics report in the prometheus text exposition format.
+    The entries are left out, their uris would make too many series.
+    '''
+    lines = [
+        "# HELP registry_build_duration_seconds Duration of the registry build",
+        "# TYPE registry_build_duration_seconds gauge",
+        "registry_build_duration_seconds {0}".format(report["duration"]),
+        "# HELP registry_build_stage_duration_seconds Duration of every registry build stage",
+        "# TYPE registry_build_stage_duration_seconds gauge",
+    ]
+    for name, stage in report["stages"].items():
+        lines.append('registry_build_stage_duration_seconds{{stage="{0}"}} {1}'.format(name, stage["duration"]))
+    for name, value in report["totals"].items():
+        lines.append("# TYPE registry_build_{0} gauge".format(name))
+        lines.append("registry_build_{0} {1}".format(name, value))
+        for stage_name, stage in report["stages"].items():
+            if name in stage:
+                lines.append('registry_build_{0}{{stage="{1}"}} {2}'.format(name, stage_name, stage[name]))
+        for host, counters in report["hosts"].items():
+            if name in counters:
+                lines.append('registry_build_{0}{{host="{1}"}} {2}'.format(name, host.replace('"', ""), counters[name]))
+    return "\n".join(lines) + "\n"
+
+def in_context(function):
+    '''
+    wrap a function so it runs with the current stage and entry, for thread pools that do not copy the context like asyncio.to_thread does
+    :param function: the function to wrap
+    :return: function that runs function in a copy of the context it was wrapped in
+    '''
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+_metrics = Metrics()
+
+def get_metrics():
+    '''
+    get the metrics of the running build
+    '''
+    return _metrics
@@ -0,0 +1,185 @@
+#this file will contain the cache of json-ld @context documents
+#remote contexts in a json-ld document are replaced by their content before the document is parsed, so rdflib never fetches them
+#the common contexts (ro-crate, schema.org) are bundled in src/contexts, other contexts are fetched once
+#and kept in memory and on disk next to the http cache
+import os
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urljoin
+from utils.singleton.location import singleton
+from utils.singleton.logger import get_logger
+from utils.httpcache import cached_get, DEFAULT_CACHE_DIR
+from utils.instrumentation import get_metrics
+
+logger = get_logger()
+
+#bundled copies of the json-ld contexts
+CONTEXTS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "contexts")
+#the uris of the bundled contexts and their file in CONTEXTS_FOLDER
+#the ro-crate 1.3 context also defines the prof: terms (Profile, ResourceDescriptor, hasResource, ...), the 1.1 context does not.
+#The versions do not define the same terms with the same iris, so the 1.2 and 1.2-DRAFT contexts (the profiles in test/data use 1.2)
+#are not read from another copy, they are fetched once and kept on disk like any other context
+BUNDLED_CONTEXTS = {
+    "https://w3id.org/ro/crate/1.1/context": "ro-crate-1.1.jsonld",
+    "https://w3id.org/ro/crate/1.3/context": "ro-crate-1.3.jsonld",
+    "https://schema.org": "schema.org.jsonld",
+    "https://schema.org/": "schema.org.jsonld",
+    "http://schema.org": "schema.org.jsonld",
+    "http://schema.org/": "schema.org.jsonld",
+    "https://schema.org/docs/jsonldcontext.jsonld": "schema.org.jsonld",
+    "http://schema.org/docs/jsonldcontext.jsonld": "schema.org.jsonld",
+}
+DEFAULT_CONTEXT_CACHE_DIR = os.environ.get("JSONLD_CONTEXT_CACHE_DIR", os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), "contexts"))
+#seconds a fetched context is used before it is fetched again, published contexts are versioned and hardly ever change
+DEFAULT_CONTEXT_TTL = int(os.environ.get("JSONLD_CONTEXT_TTL", 30 * 24 * 60 * 60))
+#remote contexts that refer to other remote contexts are followed this many levels deep
+MAX_CONTEXT_DEPTH = 5
+
+@singleton
+class ContextCache():
+    def __init__(self, directory=DEFAULT_CONTEXT_CACHE_DIR, ttl=DEFAULT_CONTEXT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory = {} #the @context of every context document by uri, None when it could not be loaded
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"ContextCache(directory={self.directory}, contexts={len(self.memory)})"
+
+    def path(self, uri):
+        return os.path.join(self.directory, hashlib.sha256(uri.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, uri):
+        '''
+        get the @context of a context document, from memory, the bundled contexts, the disk cache or the web, in that order
+        :param uri: the uri of the context document
+        :return: the value of its @context or None when it can not be loaded
+        '''
+        with self.lock:
+            if uri in self.memory:
+                return self.memory[uri]
+        context = self.read_bundled(uri)
+        if context is None:
+            context = self.read_cached(uri)
+        if context is None:
+            context = self.fetch(uri)
+        #a context that could not be loaded is not tried again during this build
+        with self.lock:
+            self.memory[uri] = context
+        return context
+
+    def read_bundled(self, uri):
+        if uri not in BUNDLED_CONTEXTS:
+            return None
+        with open(os.path.join(CONTEXTS_FOLDER, BUNDLED_CONTEXTS[uri])) as f:
+            return json.load(f)["@context"]
+
+    def read_cached(self, uri):
+        try:
+            with open(self.path(uri)) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached.get("fetched", 0) > self.ttl:
+            return None
+        return cached["context"]
+
+    def fetch(self, uri):
+        '''
+        fetch a context document and store its @context on disk
+        :return: the value of its @context or None when it can not be fetched
+        '''
+        try:
+            response = cached_get(uri, headers={"Accept": "application/ld+json, application/json;q=0.9"})
+            response.raise_for_status()
+            context = response.json()["@context"]
+        except Exception as e:
+            logger.warning(f"Could not load json-ld context {uri}: {e}")
+            return None
+        get_metrics().count("jsonld_contexts_fetched")
+        logger.info(f"Fetched json-ld context {uri}")
+        with open(self.path(uri), "w") as f:
+            json.dump({"uri": uri, "fetched": time.time(), "context": context}, f)
+        return context
+
+    def resolve(self, context, base, depth=0, remote=False):
+        '''
+        replace the remote contexts in the value of a @context by their content.
+        The content of a remote context loses the uri it was loaded from, so the context references in it are made absolute
+        against that uri and its @base is dropped, like a json-ld processor ignores @base in a remote context
+        :param context: the value of a @context, a uri, a context dict or a list of those
+        :param base: the uri relative context uris are resolved against
+        :param remote: True when the value comes from a remote context
+        :return: the value with every remote context that could be loaded replaced
+        '''
+        if isinstance(context, list):
+            resolved = []
+            for item in context:
+                item = self.resolve(item, base, depth, remote)
+                resolved.extend(item if isinstance(item, list) else [item])
+            return resolved
+        if isinstance(context, dict):
+            return self.resolve_definitions(context, base, depth, remote)
+        if not isinstance(context, str) or depth >= MAX_CONTEXT_DEPTH:
+            return context
+        uri = urljoin(base or "", context)
+        loaded = self.get(uri)
+        if loaded is None:
+            #left to rdflib, a reference from a remote context is made absolute as it would resolve against the document instead
+            return uri if remote else context
+        return self.resolve(loaded, uri, depth + 1, remote=True)
+
+    def resolve_definitions(self, context, base, depth, remote):
+        '''
+        resolve the scoped contexts and the @import of a context dict, see resolve
+        '''
+        resolved = {}
+        for term, definition in context.items():
+            if term == "@base" and remote:
+                continue
+            if term == "@import" and isinstance(definition, str):
+                definition = urljoin(base or "", definition)
+            elif isinstance(definition, dict) and "@context" in definition and depth < MAX_CONTEXT_DEPTH:
+                definition = dict(definition)
+                definition["@context"] = self.resolve(definition["@context"], base, depth + 1, remote)
+            resolved[term] = definition
+        return resolved
+
+    def inline(self, json_data, base):
+        '''
+        replace the remote contexts of a json-ld document and of the nodes in it, the document is changed in place
+        :param json_data: the json of the document
+        :param base: the uri of the document
+        :return: the document
+        '''
+        if isinstance(json_data, list):
+            for item in json_data:
+                self.inline(item, base)
+        elif isinstance(json_data, dict):
+            for key, value in json_data.items():
+                if key == "@context":
+                    json_data[key] = self.resolve(value, base)
+                elif isinstance(value, (dict, list)):
+                    self.inline(value, base)
+        return json_data
+
+def inline_contexts(data, base):
+    '''
+    read a json-ld document and replace its remote contexts by their cached content, so parsing it does not fetch them
+    :param data: the json-ld document (str or bytes) or its already decoded json, which is changed in place
+    :param base: the uri of the document
+    :return: the document as a dict that rdflib can parse without serializing it again, or a str for other json
+    '''
+    if isinstance(data, (str, bytes)):
+        try:
+            json_data = json.loads(data)
+        except ValueError:
+            return data
+    else:
+        json_data = data
+    json_data = ContextCache().inline(json_data, str(base) if base is not None else None)
+    #rdflib only takes a dict as python data
+    return json_data if isinstance(json_data, dict) else json.dumps(json_data)
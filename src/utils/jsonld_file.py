@@ -1,10 +1,32 @@
 #this file will contain all functions that will be important to get info from a json file 
 import csv
 import json
+import functools
+from urllib.parse import urljoin
 from utils.singleton.location import Location
 from utils.singleton.logger import get_logger
+from utils.jsonld_contexts import ContextCache
+from utils.lazy_import import lazy_import
 
 logger = get_logger()
+rdflib = lazy_import("rdflib")
+
+#the well known ro-crate contexts, crates that only use one of these can be read without parsing them to rdf
+#1.1 and 1.3 are bundled, the others are fetched once by the context cache, see utils.jsonld_contexts
+ROCRATE_CONTEXTS = (
+    "https://w3id.org/ro/crate/1.1/context",
+    "https://w3id.org/ro/crate/1.2-DRAFT/context",
+    "https://w3id.org/ro/crate/1.2/context",
+    "https://w3id.org/ro/crate/1.3/context",
+)
+PROFILE_TYPE = "http://www.w3.org/ns/dx/prof/Profile"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+#the predicates the candidate_profiles query follows
+SCHEMA_ABOUT = "http://schema.org/about"
+SCHEMA_CONFORMSTO = "http://schema.org/conformsTo"
+SCHEMA_HASPART = "http://schema.org/hasPart"
+SCHEMA_ITEMLISTELEMENT = "http://schema.org/itemListElement"
+CANDIDATE_PREDICATES = (SCHEMA_ABOUT, SCHEMA_CONFORMSTO, SCHEMA_HASPART, SCHEMA_ITEMLISTELEMENT)
 
 def has_conformsTo_prop(json_data):
     try:
@@ -112,4 +134,127 @@ def get_metadata_profile(json_data):
     except Exception as e:
         logger.error(f"Error while getting metadata of json file: {e}")
         logger.exception(e)
-        return None
\ No newline at end of file
+        return None
+
+@functools.lru_cache(maxsize=None)
+def get_context_terms(context_uri):
+    '''
+    get the term definitions of a well known ro-crate context from the context cache
+    :param context_uri: one of the uris in ROCRATE_CONTEXTS
+    :return: dict of term to iri, None when the context could not be loaded
+    '''
+    context = ContextCache().get(context_uri)
+    if not isinstance(context, dict):
+        return None
+    terms = {}
+    for term, definition in context.items():
+        if term.startswith("@"):
+            continue
+        if isinstance(definition, dict):
+            definition = definition.get("@id")
+        if isinstance(definition, str):
+            terms[term] = definition
+    return terms
+
+def expand_term(term, terms):
+    '''
+    expand a property or type of a crate to an iri like a json-ld processor does for a context without @vocab
+    :return: the iri or None when the term is not defined
+    '''
+    if term in terms:
+        return terms[term]
+    if ":" in term:
+        prefix, suffix = term.split(":", 1)
+        if prefix in terms and not suffix.startswith("//"):
+            return terms[prefix] + suffix
+        return term
+    return None
+
+def expand_id(node_id, base, terms):
+    '''
+    expand the @id of a node of a crate, relative ids are resolved against the uri of the crate
+    '''
+    if node_id.startswith("_:"):
+        return node_id
+    if ":" in node_id:
+        prefix, suffix = node_id.split(":", 1)
+        if prefix in terms and not suffix.startswith("//"):
+            return terms[prefix] + suffix
+    return urljoin(base, node_id)
+
+def get_rocrate_candidates(json_data, base, nodes=None):
+    '''
+    find the uris that a crate with a well known ro-crate context points to by walking its @graph instead of parsing it to rdf.
+    The result is the same as the candidate_profiles query on the parsed crate: the conformsTo of the nodes something is about
+    and the itemListElement of the parts of a node.
+    Anything this walk can not answer the same way as the json-ld parser (other contexts, embedded nodes, profiles, literal links)
+    gives None, the document then has to be parsed.
+    :param json_data: the json of the crate
+    :param base: the uri of the crate
+    :param nodes: set that gets the iri of every node of the crate, the triples of the crate are about these nodes
+    :return: list of candidate uris (URIRef) or None
+    '''
+    if not isinstance(json_data, dict) or set(json_data) != {"@context", "@graph"}:
+        return None
+    context = json_data["@context"]
+    if isinstance(context, list) and len(context) == 1:
+        context = context[0]
+    if not isinstance(context, str) or context not in ROCRATE_CONTEXTS or not isinstance(json_data["@graph"], list):
+        return None
+    terms = get_context_terms(context)
+    if terms is None:
+        return None
+    #links between the nodes of the crate, by node and predicate
+    links = {}
+    for index, entry in enumerate(json_data["@graph"]):
+        if not isinstance(entry, dict):
+            return None
+        if "@id" in entry:
+            if not isinstance(entry["@id"], str):
+                return None
+            node = expand_id(entry["@id"], base, terms)
+            if nodes is not None:
+                nodes.add(node)
+        else:
+            #a node without @id can not be referred to
+            node = ("unnamed", index)
+        node_links = links.setdefault(node, {})
+        for key, value in entry.items():
+            if key == "@id":
+                continue
+            if key == "@type":
+                types = value if isinstance(value, list) else [value]
+                if not all(isinstance(typen, str) for typen in types):
+                    return None
+                #profiles are parsed, their metadata is read from the graph
+                if any(expand_term(typen, terms) == PROFILE_TYPE for typen in types):
+                    return None
+                continue
+            if key.startswith("@"):
+                return None
+            predicate = expand_term(key, terms)
+            if predicate == RDF_TYPE:
+                #a type that is not given with @type could make a profile
+                return None
+            for item in (value if isinstance(value, list) else [value]):
+                if item is None:
+                    continue
+                if isinstance(item, dict) and set(item) == {"@id"} and isinstance(item["@id"], str):
+                    if predicate in CANDIDATE_PREDICATES:
+                        node_links.setdefault(predicate, []).append(expand_id(item["@id"], base, terms))
+                    continue
+                if isinstance(item, dict) and "@value" in item and set(item) <= {"@value", "@type", "@language", "@direction"}:
+                    item = item["@value"]
+                if isinstance(item, (dict, list)) or predicate in CANDIDATE_PREDICATES:
+                    #embedded nodes and literals the query would match are left to the json-ld parser
+                    return None
+    described = {target for node_links in links.values() for target in node_links.get(SCHEMA_ABOUT, [])}
+    candidates = []
+    for node, node_links in links.items():
+        if node in described:
+            candidates.extend(node_links.get(SCHEMA_CONFORMSTO, []))
+        for part in node_links.get(SCHEMA_HASPART, []):
+            candidates.extend(links.get(part, {}).get(SCHEMA_ITEMLISTELEMENT, []))
+    if any(candidate.startswith("_:") for candidate in candidates):
+        return None
+    return [rdflib.URIRef(candidate) for candidate in dict.fromkeys(candidates)]
@@ -0,0 +1,38 @@
+#this file will contain the lazy import of the heavy libraries (rdflib, its sparql engine, requests, jinja2)
+#together they take most of the start up time, a LazyModule only imports its module when one of its attributes is used,
+#so a run that stops before harvesting (e.g. a missing data folder) or that never renders a page does not pay for them
+import importlib
+
+class LazyModule():
+    '''
+    stand-in for a module that is imported on first attribute access
+    e.g. rdflib = LazyModule("rdflib") and later rdflib.Graph()
+    '''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __repr__(self) -> str:
+        return f"LazyModule(name={self._name}, loaded={self._module is not None})"
+
+    def load(self):
+        '''
+        import the module if that did not happen yet
+        :return: the module
+        '''
+        if self._module is None:
+            #import_module is thread safe, threads that get here at the same time get the same module
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        #only called for attributes that are not set on the LazyModule itself
+        return getattr(self.load(), attribute)
+
+def lazy_import(name):
+    '''
+    get a module that is imported the first time it is used
+    :param name: the full name of the module, e.g. rdflib.plugins.sparql
+    :return: LazyModule for the module
+    '''
+    return LazyModule(name)
@@ -0,0 +1,208 @@
+#this file will contain the build manifest that makes registry builds incremental
+#the manifest records per csv row a hash of the row, the documents that were harvested for it (with the validators and
+#content hash of every response that was read for them, landing pages included, and their number of triples) and the profiles that were found. The harvested documents themselves are stored
+#as named graphs in an n-quads file next to the manifest, the crates that were read as json and never parsed are stored as json. A later build only re-harvests the rows that are new,
+#changed or older than the ttl, or whose documents changed upstream (revalidated with conditional GETs),
+#and splices the stored graphs and profiles of the other rows back in. Rows with documents that could not be fetched are not recorded.
+#The manifest is kept next to the http cache, the build folder is published and does not survive between action runs
+import os
+import json
+import time
+import hashlib
+import threading
+from utils.singleton.logger import get_logger
+from utils.lazy_import import lazy_import
+from utils.httpcache import cached_get, DEFAULT_CACHE_DIR
+from utils.instrumentation import get_metrics
+
+logger = get_logger()
+rdflib = lazy_import("rdflib")
+
+MANIFEST_FILE = "manifest.json"
+GRAPH_FILE = "harvest.nq"
+#crates that were read as json and never parsed, by the name of their graph
+UNPARSED_FILE = "unparsed.json"
+MANIFEST_VERSION = 4
+DEFAULT_MANIFEST_DIR = os.environ.get("BUILD_MANIFEST_DIR", os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), "manifest"))
+#seconds after which a row is harvested again even when it did not change
+DEFAULT_TTL = int(os.environ.get("MANIFEST_TTL", 24 * 60 * 60))
+
+def row_hash(entry):
+    '''
+    hash of the content of a csv row, a changed URI or contact gives a new hash
+    :param entry: the entry of the registry array
+    :return: the hex digest
+    '''
+    content = "{0}\n{1}".format(entry["URI"].strip(), entry["contact"].get_contact())
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def to_json_value(value):
+    '''
+    rdflib terms are stored as plain strings, they render the same in the html templates
+    '''
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set)):
+        return [to_json_value(item) for item in value]
+    return str(value)
+
+class BuildManifest():
+    def __init__(self, folder=DEFAULT_MANIFEST_DIR, ttl=DEFAULT_TTL):
+        self.folder = folder
+        self.ttl = ttl
+        self.previous = {} #row records of the previous build by row hash
+        self.rows = {} #row records of this build by row hash
+        self.previous_dataset = None
+        self.previous_unparsed = None
+        self.unparsed = {} #json of the unparsed crates of the restored rows by the name of their graph
+        self.fresh = {} #row hash to the outcome of is_fresh during this build
+        self.unchanged = {} #document uri to the outcome of its revalidation during this build
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"BuildManifest(folder={self.folder}, previous={len(self.previous)}, rows={len(self.rows)})"
+
+    def load(self):
+        '''
+        load the manifest of the previous build, a missing or unreadable manifest means everything is harvested again
+        '''
+        path = os.path.join(self.folder, MANIFEST_FILE)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            logger.info("No previous build manifest found, harvesting all entries")
+            return
+        if manifest.get("version") != MANIFEST_VERSION or not os.path.isfile(os.path.join(self.folder, GRAPH_FILE)):
+            logger.info("Previous build manifest can not be used, harvesting all entries")
+            return
+        self.previous = manifest["rows"]
+        logger.info(f"Loaded build manifest with {len(self.previous)} rows")
+
+    def is_fresh(self, entry):
+        '''
+        check if the row was harvested by a previous build and did not change or expire since.
+        The documents of the row are revalidated once per build, a document that changed upstream makes the row stale
+        '''
+        key = row_hash(entry)
+        with self.lock:
+            if key in self.fresh:
+                return self.fresh[key]
+        record = self.previous.get(key)
+        fresh = (
+            record is not None
+            and time.time() - record["harvested"] < self.ttl
+            and all(self.revalidate_document(document) for document in record["documents"])
+        )
+        with self.lock:
+            self.fresh[key] = fresh
+        return fresh
+
+    def revalidate_document(self, document):
+        '''
+        check if none of the responses that were read for a harvested document changed, a document without responses is harvested again
+        '''
+        return bool(document["fetches"]) and all(self.revalidate(fetch) for fetch in document["fetches"])
+
+    def revalidate(self, fetch):
+        '''
+        check if a response that was read for a harvested document did not change, with a conditional GET that sends its stored ETag/Last-Modified.
+        The answer is compared with the stored status and content hash. The request goes through the http cache,
+        so a document that did change is not fetched again when its row is harvested
+        :param fetch: the record of the response in the manifest, see ProfileHarvester.fetches
+        :return: True when the response did not change
+        '''
+        if fetch.get("content_hash") is None:
+            #nothing is known about the response, the row is harvested again
+            return False
+        uri = fetch["uri"]
+        key = (uri, fetch["accept"])
+        with self.lock:
+            if key in self.unchanged:
+                return self.unchanged[key]
+        headers = {"Accept": fetch["accept"]}
+        if "ETag" in fetch["validators"]:
+            headers["If-None-Match"] = fetch["validators"]["ETag"]
+        if "Last-Modified" in fetch["validators"]:
+            headers["If-Modified-Since"] = fetch["validators"]["Last-Modified"]
+        try:
+            response = cached_get(uri, headers=headers)
+            #the http cache answers a 304 with its stored copy, a bare 304 means it had none
+            unchanged = response.status_code == 304 or (
+                response.status_code == fetch["status"] and hashlib.sha256(response.content).hexdigest() == fetch["content_hash"]
+            )
+        except Exception as e:
+            logger.info(f"Could not revalidate {uri}, harvesting it again: {e}")
+            unchanged = False
+        get_metrics().count("manifest_documents_revalidated")
+        if not unchanged:
+            logger.info(f"{uri} changed since the previous build")
+            get_metrics().count("manifest_documents_changed")
+        with self.lock:
+            self.unchanged[key] = unchanged
+        return unchanged
+
+    def record(self, entry, harvester, profiles):
+        '''
+        record a row that was harvested during this build, the caller only records rows whose documents were all fetched
+        :param entry: the entry of the registry array
+        :param harvester: the harvester of the entry
+        :param profiles: the profile dicts that were found for the entry
+        '''
+        documents = []
+        for document in harvester.getHarvesters():
+            documents.append({
+                "uri": str(document.entry_uri),
+                "graph": str(document.document_graph.identifier),
+                "fetches": document.fetches,
+                #a crate read as json is not parsed to count its triples
+                "triples": None if document.unparsed is not None else len(document.document_graph),
+            })
+        self.rows[row_hash(entry)] = {
+            "uri": entry["URI"],
+            "harvested": time.time(),
+            "documents": documents,
+            "profiles": {str(uri): {key: to_json_value(value) for key, value in profile.items()} for uri, profile in profiles.items()},
+        }
+
+    def restore(self, entry, dataset):
+        '''
+        splice the stored documents of an unchanged row into the dataset of this build
+        :param entry: the entry of the registry array
+        :param dataset: the dataset the harvested documents of this build are in
+        :return: the profile dicts that were found for the entry
+        '''
+        if self.previous_unparsed is None:
+            try:
+                with open(os.path.join(self.folder, UNPARSED_FILE)) as f:
+                    self.previous_unparsed = json.load(f)
+            except (OSError, ValueError):
+                self.previous_unparsed = {}
+        record = self.previous[row_hash(entry)]
+        for document in record["documents"]:
+            if document["graph"] in self.previous_unparsed:
+                #kept as json, it is not parsed by this build either
+                self.unparsed[document["graph"]] = self.previous_unparsed[document["graph"]]
+                continue
+            if self.previous_dataset is None:
+                self.previous_dataset = rdflib.Dataset()
+                self.previous_dataset.parse(os.path.join(self.folder, GRAPH_FILE), format="nquads")
+            identifier = rdflib.URIRef(document["graph"])
+            target = dataset.graph(identifier)
+            target += self.previous_dataset.graph(identifier)
+        self.rows[row_hash(entry)] = record
+        return record["profiles"]
+
+    def save(self, dataset, unparsed=None):
+        '''
+        write the manifest and the harvested documents of this build
+        :param dataset: the dataset the harvested documents of this build are in
+        :param unparsed: the json of the crates of this build that were read as json and not parsed, by the name of their graph
+        '''
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, MANIFEST_FILE), "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "rows": self.rows}, f, indent=1)
+        dataset.serialize(destination=os.path.join(self.folder, GRAPH_FILE), format="nquads")
+        with open(os.path.join(self.folder, UNPARSED_FILE), "w") as f:
+            json.dump({**self.unparsed, **(unparsed or {})}, f)
+        logger.info(f"Wrote build manifest with {len(self.rows)} rows")
@@ -0,0 +1,126 @@
+#this file will contain the optional process pool that parses fetched rdf documents outside of the main process
+#rdflib parses json-ld and rdf/xml in pure python, so parsing in the harvester threads only ever uses one core.
+#With PARSE_WORKERS > 0 big documents are parsed by worker processes that send the parsed triples back,
+#the main process only has to add them to the shared graph
+import os
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from utils.singleton.logger import get_logger
+from utils.instrumentation import get_metrics
+from utils.jsonld_contexts import inline_contexts
+from utils.lazy_import import lazy_import
+
+logger = get_logger()
+rdflib = lazy_import("rdflib")
+
+#number of worker processes, 0 parses every document inline like before
+DEFAULT_PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", 0))
+#documents smaller than this are parsed inline, sending them to a worker costs more than it saves
+DEFAULT_MIN_BYTES = int(os.environ.get("PARSE_POOL_MIN_BYTES", 64 * 1024))
+
+def parse_to_triples(data, format, publicID=None):
+    '''
+    parse a document, this runs in the worker processes.
+    The triples are pickled to the main process, which is cheaper than serializing them to n-triples and parsing those again.
+    Blank nodes keep their (uuid based) identifiers so they do not collide with the blank nodes of other workers
+    :param data: the document (str or bytes)
+    :param format: the rdflib format of the document
+    :param publicID: the uri relative uris in the document are resolved against
+    :return: list of the triples
+    '''
+    graph = rdflib.Graph()
+    graph.parse(data=data, format=format, publicID=publicID)
+    return list(graph)
+
+def ready():
+    return True
+
+class ParsePool():
+    def __init__(self, workers=DEFAULT_PARSE_WORKERS, min_bytes=DEFAULT_MIN_BYTES):
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"ParsePool(workers={self.workers}, min_bytes={self.min_bytes})"
+
+    def start(self):
+        '''
+        start the worker processes.
+        The workers are forked, so this has to be called from the main thread before the harvester threads are started,
+        prepare parses inline in threads of a pool that was not started
+        '''
+        if self.workers <= 0:
+            return
+        with self.lock:
+            if self.executor is None:
+                #fork instead of spawn, spawn would import main.py again in every worker
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+                logger.info(f"Started {self.workers} parse workers")
+        self.executor.submit(ready).result()
+
+    def shutdown(self):
+        '''
+        stop the worker processes, a later start forks new ones
+        '''
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def prepare(self, data, format, publicID=None, decoded=None):
+        '''
+        parse a document as far as possible without touching the graph it is added to.
+        Big documents are parsed by a worker, the others are parsed inline when they are loaded
+        :param data: the document (str or bytes), None when only the decoded json is left
+        :param format: the rdflib format of the document
+        :param publicID: the uri relative uris in the document are resolved against
+        :param decoded: the json of a json-ld document that was already decoded, it is not decoded again
+        :return: function that adds the triples of the document to a graph
+        '''
+        size = len(data) if data is not None else 0
+        if format == "json-ld":
+            #remote @context documents come from the context cache instead of being fetched by rdflib
+            data = inline_contexts(data if decoded is None else decoded, publicID)
+        if self.workers <= 0 or size < self.min_bytes:
+            return lambda graph: graph.parse(data=data, format=format, publicID=publicID)
+        executor = self.executor
+        if executor is None:
+            if threading.current_thread() is not threading.main_thread():
+                #forking from a harvester thread would copy locks that other threads hold, the pool is only started by the main thread
+                logger.debug(f"Parse pool not started, parsing {publicID} inline")
+                return lambda graph: graph.parse(data=data, format=format, publicID=publicID)
+            self.start()
+            executor = self.executor
+        triples = executor.submit(parse_to_triples, data, format, publicID).result()
+        get_metrics().count("documents_parsed_in_pool")
+        return lambda graph: graph.addN((s, p, o, graph) for s, p, o in triples)
+
+    def parse(self, graph, data, format, publicID=None, lock=None):
+        '''
+        parse a document into a graph, using a worker for big documents
+        :param graph: the graph to add the triples to
+        :param data: the document (str or bytes)
+        :param format: the rdflib format of the document
+        :param publicID: the uri relative uris in the document are resolved against
+        :param lock: lock that is held while the triples are added to the graph, the worker parse runs without it
+        '''
+        load = self.prepare(data, format, publicID)
+        with lock or contextlib.nullcontext():
+            load(graph)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    '''
+    get the shared parse pool, it is made on first use
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ParsePool()
+        return _pool
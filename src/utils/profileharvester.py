@@ -1,151 +1,281 @@
 #this file will contain the profileharvester class
 
-import requests
+import os
 import re
 import json
-import rdflib
-import time
+import hashlib
+import functools
+from collections import deque
 from utils.singleton.location import Location
 from utils.singleton.logger import get_logger
+from utils.httpcache import cached_get
+from utils.resolution_cache import ResolutionCache
+from utils.queries import run_query
+from utils.instrumentation import get_metrics
+from utils.parsepool import get_parse_pool
+from utils.jsonld_file import get_rocrate_candidates
+from utils.lazy_import import lazy_import
+from utils.deadlines import DeadlineExceeded
+from utils.html_head import describedby_links
 
 logger = get_logger()
+rdflib_graph = lazy_import("rdflib.graph")
+
+#mime types that can be parsed into the kg, in order of preference
+MIME_TYPES = ["text/turtle", "application/ld+json", "application/rdf+xml", "application/json"]
+#maximum number of describedby/ro-crate-metadata.json rewrites of the entry_uri that are followed
+MAX_REWRITES = int(os.environ.get("HARVEST_MAX_REWRITES", 5))
+#rdflib parser format for every mime type that can be inserted into the kg
+RDF_FORMATS = {
+    "text/turtle": "turtle",
+    "application/ld+json": "json-ld",
+    "application/json": "json-ld",
+    "application/rdf+json": "json-ld",
+    "application/rdf+xml": "xml",
+}
+
+def accept_header(preferred=None):
+    '''
+    make the weighted Accept header used to negotiate the content of an entry_uri in a single request.
+    html is accepted with a lower weight so the describedby links of a landing page can be read from the same response.
+    :param preferred: mime type that gets the highest weight, e.g. the type of a describedby link
+    :return: the Accept header value
+    '''
+    mime_types = MIME_TYPES
+    if preferred in MIME_TYPES:
+        mime_types = [preferred] + [mime_type for mime_type in MIME_TYPES if mime_type != preferred]
+    weighted = [mime_types[0]] + ["{0};q={1:.1f}".format(mime_type, 0.9 - 0.1 * i) for i, mime_type in enumerate(mime_types[1:])]
+    return ", ".join(weighted + ["text/html;q=0.5", "*/*;q=0.1"])
+
+@functools.lru_cache(maxsize=None)
+def documents_view_class():
+    '''
+    the DocumentsView class, it is made on first use because its base class would load rdflib on import
+    '''
+    class DocumentsView(rdflib_graph.ReadOnlyGraphAggregate):
+        '''
+        read-only union of the named graphs of harvested documents.
+        The triples stay in the shared dataset, a triple found in more than one document is only returned once.
+        '''
+        def triples(self, triple):
+            seen = set()
+            for found in super().triples(triple):
+                if found not in seen:
+                    seen.add(found)
+                    yield found
+        
+        def __len__(self):
+            return sum(1 for _ in self.triples((None, None, None)))
+    return DocumentsView
 
 class ProfileHarvester():
-    def __init__(self, uri):
+    def __init__(self, uri, resolution_cache=None, depth=0, response=None):
         self.entry_uri = uri  #rename entry_uri
+        self.prefetched_response = response #response of the entry_uri that was already fetched, e.g. by the uri check
         # add state var for set of profiles (ie _uri) harvested from entry_uri
         self.entry_uri_content = None  #rename entry_content
         self.entry_uri_content_type = None #this will be categorically set to ["profile","crate","registry","other"]
         self.entry_uri_type = None
+        self.type_hint = None #mime type announced by a describedby link
         self.bad_entry_uri = False
         self.check_again = True
         self.profiles = set() #set of profiles harvested from entry_uri
-        self.kg = rdflib.Graph()
-        self.children = []
+        self.children = [] #harvesters made and harvested by this harvester
+        self.shared_children = [] #harvesters of child uris that were already resolved elsewhere during the build
+        self.depth = depth
+        self.harvest_error = None #exception raised while harvesting the entry_uri
+        self.deferred = False #True when the build budget ran out before the entry_uri was harvested
+        self.fetches = [] #uri, Accept header, status, validators and content hash of every response read, the landing page included
+        self.fetch_failed = False #True when a request failed (connection error, timeout or 5xx), the result is not complete
+        #build wide cache of resolved uris, a standalone harvester gets its own
+        if resolution_cache is None:
+            resolution_cache = ResolutionCache()
+            resolution_cache.add(uri, self)
+        self.resolution_cache = resolution_cache
+        #named graph of this document in the dataset shared by the build, see kg
+        self.document_graph = resolution_cache.document_graph(uri)
+        self.unparsed = None #json of a crate that was read as json, it is only parsed into document_graph when its triples are needed
+        self.described = set() #iris of the nodes of the unparsed crate
+    
+    @property
+    def kg(self):
+        '''
+        the named graph of this document, a crate that was read as json is parsed the first time its graph is needed
+        '''
+        if self.unparsed is not None:
+            self.insert_metadata()
+        return self.document_graph
          
     def harvest(self):
         '''
-        this function will harvest the metadata from the uri provided
+        this function will harvest the metadata from the uri provided and from all the child uris it links to.
+        The children are harvested breadth first from a queue instead of recursively, see utils.crawler for the concurrent version
         '''
+        frontier = deque([self])
+        while frontier:
+            harvester = frontier.popleft()
+            harvester.harvest_entry()
+            frontier.extend(harvester.children)
+        logger.info(msg="Finished harvesting metadata from uri {0}".format(self.entry_uri))
+        logger.info(msg="harvested profiles: {0}".format(self.getProfiles()))
+    
+    def harvest_entry(self):
+        '''
+        fetch and parse the entry_uri itself and discover its children without harvesting them
+        '''
+        fetches = 0
         while self.check_again:
+            #every fetch after the first follows a rewrite of the entry_uri
+            if fetches > MAX_REWRITES:
+                logger.error(msg="Stopped following {0} after {1} describedby/ro-crate-metadata.json rewrites".format(self.entry_uri, MAX_REWRITES))
+                self.check_again = False
+                break
             self.check_entry_uri_content_and_type()
+            fetches += 1
         
         if self.entry_uri_type == None:
             self.bad_entry_uri = True
         
-        self.insert_metadata()
-        self.extract_type_from_kg()        
-        logger.info(msg="Finished harvesting metadata from uri {0}".format(self.entry_uri))
-        logger.info(msg="harvested profiles: {0}".format(self.profiles))
+        #plain ro-crates find their children from the json and are only parsed when their triples are needed,
+        #the other documents are parsed into their named graph and queried
+        json_data = self.read_json()
+        if not self.extract_type_from_json(json_data):
+            self.insert_metadata(json_data)
+            self.extract_type_from_kg()
+        #the triples are in the named graph of the document, the body is not kept for the rest of the build
+        self.entry_uri_content = None
 
     def check_entry_uri_content_and_type(self):
         '''
         try and get the metadata from the uri provided.
-        First do request to the uri with content negotiation to get the metadata.
-        The types to negotiate are: application/json, application/rdf+xml, application/rdf+json, application/ld+json, text/turtle
-        If the request is successful then then set self.metadata "mimetype" to the mimetype of the response and set self.metadata "data" to the response data
-        if request is not successful then look into the head of the uri and see if there is a property link with rel=describedby that has link to the metadata
-        if there is a link then try and get the metadata from the link and then set self.uri to the link and self.uri_change to True
-        if there is no link then set self.uri to self.uri+ro-crate-metadata.json and self.uri_change to True
+        One request is done to the uri with a weighted Accept header so the server can pick the best rdf serialization it has.
+        The Content-Type of the response decides the parser, the types that can be parsed are: text/turtle, application/ld+json, application/rdf+xml, application/json
+        If the response is one of these then set self.entry_uri_type to the mimetype of the response and self.entry_uri_content to the response data
+        if not then look into the Link header and the html head of the same response for a link with rel=describedby that has link to the metadata
+        if there is a link then set self.entry_uri to the link and self.check_again to True
+        if there is no link then set self.entry_uri to self.entry_uri+ro-crate-metadata.json and self.check_again to True
         '''
         self.check_again = False
-        mime_types = ["text/turtle", "application/ld+json", "application/rdf+xml", "application/json"]
-        for mime_type in mime_types:
-            try:
-                response = requests.get(self.entry_uri, headers={"Accept": mime_type})
-                time.sleep(0.3) #check if lib exists to do this ratelimit
-                logger.debug("trying to get metadata from entry_uri {0} with mimetype {1}".format(self.entry_uri, mime_type))
-                if response.status_code == 200:
-                    logger.debug("content type: {0}".format(response.headers["Content-Type"]))
-                    #check if the response data mimetype is one of the mime_types
-                    #if it is then set self.metadata "mimetype" to the mimetype of the response and set self.metadata "data" to the response data
-                    #if it is not then set self.uri to self.uri+ro-crate-metadata.json and self.uri_change to True
-                    if mime_type in response.headers["Content-Type"]:
-                        self.entry_uri_type= mime_type
-                        self.entry_uri_content = response.text
-                        break
-            except Exception as e:
-                logger.error(msg="Error getting metadata from entry_uri {0} with mimetype {1} : {2}".format(self.entry_uri, mime_type, str(e)))
-                self.bad_entry_uri = True
-                break
+        #the prefetched response was fetched with the same Accept header, the type hint is only set by a describedby link
+        accept = accept_header(self.type_hint)
+        try:
+            if self.prefetched_response is not None:
+                response, self.prefetched_response = self.prefetched_response, None
+            else:
+                response = cached_get(self.entry_uri, headers={"Accept": accept})
+        except DeadlineExceeded:
+            #not a bad uri, the crawler records that the entry ran out of time
+            raise
+        except Exception as e:
+            logger.error(msg="Error getting metadata from entry_uri {0} : {1}".format(self.entry_uri, str(e)))
+            self.bad_entry_uri = True
+            self.fetch_failed = True
+            return
+        if response.status_code >= 500 or response.status_code == 429:
+            logger.error(msg="Error getting metadata from entry_uri {0} : status {1}".format(self.entry_uri, response.status_code))
+            self.fetch_failed = True
+        #the manifest revalidates every response that was read, so a changed landing page is noticed as well
+        self.fetches.append({
+            "uri": str(self.entry_uri),
+            "accept": accept,
+            "status": response.status_code,
+            "validators": {name: response.headers[name] for name in ("ETag", "Last-Modified") if name in response.headers},
+            "content_hash": hashlib.sha256(response.content).hexdigest(),
+        })
+        content_type = response.headers.get("Content-Type", "")
+        logger.debug("trying to get metadata from entry_uri {0}, got status {1} with content type {2}".format(self.entry_uri, response.status_code, content_type))
+        if response.status_code == 200:
+            mime_type = content_type.split(";")[0].strip().lower()
+            if mime_type in MIME_TYPES:
+                self.entry_uri_type = mime_type
+                self.entry_uri_content = response.content
+                return
         
-        if self.entry_uri_type == None:
-            logger.debug("trying to get metadata from entry_uri {0} with mimetype {1}".format(self.entry_uri, "text/html"))
-            #first look into header of the uri
-            headers = response.headers
-            logger.debug("headers: {0}".format(headers))
-            if "Link" in headers:
-                for link in headers["Link"].split(","):
-                    if "rel=describedby" in link:
-                        self.check_again = True
-                        uri_link = link.split(" ")[0].replace("<", "").replace(">", "")
-                        
-                        if uri_link.startswith("./"):
-                            self.entry_uri = self.entry_uri + uri_link[1:]
-                        else:
-                            self.entry_uri = uri_link
-                        logger.debug("entry_uri changed to {0}".format(self.entry_uri))
-                        #check if type is in link
-                        if "type=" in link:
-                            typee = link.split("type=")[1].split(" ")[0].replace('"', '')
-                            if typee in mime_types:
-                                self.entry_uri_type = typee
-                                break
-            
-            try:
-                response = requests.get(self.entry_uri)
-                if response.status_code == 200 and "text/html" in response.headers["Content-Type"]:
-                    logger.debug("checking html for link with rel=describedby")
-                    #rewrite using beautiful soup
-                    for line in response.text.split("<link"):
-                        lin_elemets = line.split("/>")
-                        for element in lin_elemets:
-                            if "rel=describedby" in element:
-                                self.check_again = True
-                                if self.entry_uri[-1] == "/":
-                                    self.entry_uri = self.entry_uri + element.split("href=")[1].split(" ")[0].replace('"', '')[2:]
-                                else:
-                                    self.entry_uri = self.entry_uri + element.split("href=")[1].split(" ")[0].replace('"', '')[1:]
-                                #check if type is in element
-                                if "type=" in element:
-                                    type = element.split("type=")[1].split(" ")[0].replace('"', '')
-                                    if type in mime_types:
-                                        self.entry_uri_type = type
-                                        break
-                    
-                    if not self.check_again:
-                        if self.entry_uri.endswith("ro-crate-metadata.json"):
-                            self.check_again = False
-                        else:
-                            self.entry_uri = self.entry_uri + "/ro-crate-metadata.json"
-                            self.check_again= True
-            except Exception as e:
-                logger.error(msg="Error getting metadata from entry_uri {0} : {1}".format(self.entry_uri, str(e)))
-                self.bad_entry_uri = True
-                pass
+        #no rdf in the response, look for a describedby link in the Link header and then in the html head of the same response
+        links = describedby_links(response)
+        if links:
+            #a link with a type that can be parsed is preferred
+            uri_link, link_type = next((link for link in links if link[1] in MIME_TYPES), links[0])
+            self.check_again = True
+            self.entry_uri = uri_link
+            if link_type in MIME_TYPES:
+                self.type_hint = link_type
+            logger.debug("entry_uri changed to {0}".format(self.entry_uri))
+            return
+        
+        #a html page without describedby link can still be the landing page of an ro-crate
+        if response.status_code == 200 and "text/html" in content_type:
+            if self.entry_uri.endswith("ro-crate-metadata.json"):
+                self.check_again = False
+            else:
+                self.entry_uri = self.entry_uri + ("" if self.entry_uri.endswith("/") else "/") + "ro-crate-metadata.json"
+                self.check_again = True
     
     def is_bad_entry_uri(self):
         return self.bad_entry_uri
     
-    def insert_metadata(self):
+    def read_json(self):
         '''
-        insert the metadata into the graph
+        decode a json-ld document once, the json is used to find the children of a crate and to parse it
+        :return: the json or None for other documents and json that can not be decoded
         '''
-        if self.entry_uri_type == "application/json" or self.entry_uri_type == "application/ld+json":
-            self.kg.parse(data=self.entry_uri_content, format="json-ld", base=self.entry_uri)
-        elif self.entry_uri_type == "application/rdf+xml":
-            self.kg.parse(data=self.entry_uri_content, format="xml", base=self.entry_uri)
-        elif self.entry_uri_type == "application/rdf+json":
-            self.kg.parse(data=self.entry_uri_content, format="json-ld", base=self.entry_uri)
-        elif self.entry_uri_type == "text/turtle":
-            #decode the self.entry_uri_content to utf-8
-            #entry_uri = self.entry_uri.decode("utf-8")
-            self.kg.parse(self.entry_uri, format="turtle") #got an error here when using the base parameter
+        if self.entry_uri_content is None or RDF_FORMATS.get(self.entry_uri_type) != "json-ld":
+            return None
+        try:
+            return json.loads(self.entry_uri_content)
+        except ValueError:
+            return None
     
+    def insert_metadata(self, json_data=None):
+        '''
+        insert the already fetched metadata into the graph.
+        The document is parsed from entry_uri_content, or from its json when it was already decoded, so it is not downloaded or decoded again.
+        Relative uris are resolved against the entry_uri.
+        :param json_data: the decoded json of a json-ld document
+        '''
+        data = self.entry_uri_content
+        if self.unparsed is not None:
+            #a crate that was read as json, its content was dropped after the harvest
+            data, json_data, self.unparsed = None, self.unparsed, None
+            get_metrics().count("documents_parsed_on_demand")
+        elif data is None or self.entry_uri_type not in RDF_FORMATS:
+            return
+        #big documents are parsed by a worker of the parse pool, only loading the triples holds the dataset lock
+        load = get_parse_pool().prepare(data, RDF_FORMATS.get(self.entry_uri_type, "json-ld"), publicID=self.entry_uri, decoded=json_data)
+        with self.resolution_cache.dataset_lock:
+            #the entry_uri can have changed through describedby links, name the graph after the document that was parsed
+            self.document_graph = self.resolution_cache.document_graph(self.entry_uri)
+            before = len(self.document_graph)
+            load(self.document_graph)
+            get_metrics().count("triples_parsed", len(self.document_graph) - before)
+    
+    def extract_type_from_json(self, json_data):
+        '''
+        find the children of a crate with a well known ro-crate context from its json instead of querying the kg, see jsonld_file.get_rocrate_candidates.
+        The crate is not parsed, its json is kept and parsed into its named graph when the kg is needed (see kg),
+        the build manifest stores it as json.
+        Crates that are profiles, use another context or need a full json-ld parser are left to extract_type_from_kg
+        :param json_data: the decoded json of the document, see read_json
+        :return: True when the document was handled
+        '''
+        if json_data is None:
+            return False
+        described = set()
+        candidates = get_rocrate_candidates(json_data, str(self.entry_uri), nodes=described)
+        if candidates is None:
+            return False
+        logger.debug("read ro-crate {0} as json, {1} candidates".format(self.entry_uri, len(candidates)))
+        get_metrics().count("documents_read_as_json")
+        #the entry_uri can have changed through describedby links, name the graph after the document that was read
+        self.document_graph = self.resolution_cache.document_graph(self.entry_uri)
+        self.unparsed = json_data
+        self.described = described
+        self.add_children(candidates)
+        return True
+
     def get_kg(self):
         #serialize the graph to ttl and return it
-        self.getCompleteKG()
-        return self.kg.serialize(format="turtle")
+        return self.getCompleteKG().serialize(format="turtle")
     
     def extract_type_from_kg(self):
         '''
@@ -177,14 +307,9 @@ class ProfileHarvester():
             # [] schema:hasPart ?candidate .
         }
         '''
-        query = '''
-        prefix prof: <http://www.w3.org/ns/dx/prof/>
-        select ?profile where { ?profile a prof:Profile . }
-        '''
-        #before doing the queries change the kg to have the entry_uri as base_uri instead of the file uri
-        self.kg
-        
-        results = self.kg.query(query)
+        #the queries are the prepared templates/profiles.sparql and templates/candidate_profiles.sparql
+        with self.resolution_cache.dataset_lock:
+            results = run_query("profiles", self.document_graph)
         if len(results) > 0:
             self.type = "profile"
             logger.debug("uri has profile(s)")
@@ -194,61 +319,71 @@ class ProfileHarvester():
                 self.profiles.add(result[0])
             return
         
-        query = '''
-        prefix schema: <http://schema.org/>
-        select ?candidate where {
-            {?rocrate schema:conformsTo ?candidate .
-            [] schema:about ?rocrate .}
-            UNION
-            {[] schema:hasPart/schema:itemListElement ?candidate .}
-        }
-        '''
-        results = self.kg.query(query)
+        with self.resolution_cache.dataset_lock:
+            results = run_query("candidate_profiles", self.document_graph)
         if len(results) > 0:
-            #the results are uri that also need to be checked for profiles so we spawn a child thread for each
-            for result in results:
-                child_uri = result[0]
-                logger.debug("child_uri: {0}".format(child_uri))
-                child_profile_harvester = ProfileHarvester(child_uri)
+            #the results are uri that also need to be checked for profiles so we make a child harvester for each
+            self.add_children([result[0] for result in results])
+
+    def add_children(self, child_uris):
+        '''
+        make a child harvester for every child uri, the children are harvested by harvest or the crawler.
+        uris that were already resolved during the build reuse the existing harvester
+        '''
+        if len(child_uris) == 0:
+            return
+        if self.depth >= self.resolution_cache.max_depth:
+            logger.warning("maximum crawl depth {0} reached at {1}, not following {2} child uris".format(self.resolution_cache.max_depth, self.entry_uri, len(child_uris)))
+            return
+        for child_uri in child_uris:
+            logger.debug("child_uri: {0}".format(child_uri))
+            child_profile_harvester, created = self.resolution_cache.get_or_create(
+                child_uri,
+                lambda: ProfileHarvester(child_uri, resolution_cache=self.resolution_cache, depth=self.depth + 1)
+            )
+            if created:
                 self.children.append(child_profile_harvester)
-                child_profile_harvester.harvest()
-                
+            elif child_profile_harvester is not self and child_profile_harvester not in self.shared_children:
+                logger.debug("child_uri {0} was already resolved, reusing its harvester".format(child_uri))
+                self.shared_children.append(child_profile_harvester)
+            
+    def getHarvesters(self):
+        '''
+        get this harvester and every harvester reachable through its (shared) children, each one only once even when references are cyclic
+        :return: list of harvesters in depth first order
+        '''
+        harvesters = []
+        visited = set()
+        to_visit = [self]
+        while to_visit:
+            harvester = to_visit.pop()
+            if id(harvester) in visited:
+                continue
+            visited.add(id(harvester))
+            harvesters.append(harvester)
+            to_visit.extend(reversed(harvester.children + harvester.shared_children))
+        return harvesters
+    
     def getProfiles(self):
         # build profiles , possibly by delegates
-        #check if we have children
-        if len(self.children) > 0:
-            for child in self.children:
-                self.profiles = self.profiles.union(child.getProfiles())
-        return self.profiles 
+        profiles = set()
+        for harvester in self.getHarvesters():
+            profiles = profiles.union(harvester.profiles)
+        return profiles
     
-    def getCompleteKG(self):
-        # build profiles , possibly by delegates
-        #check if we have children
-        if len(self.children) > 0:
-            for child in self.children:
-                try:
-                    self.kg = self.kg + child.getCompleteKG()
-                except Exception as e:
-                    logger.error(msg="Error getting complete KG from child {0} : {1}".format(child, str(e)))
-        return self.kg
+    def getCompleteKG(self, unparsed=True):
+        # the kg of this harvester and all its delegates, as a read-only view over their named graphs without copying triples
+        # unparsed=False leaves out the crates that were read as json instead of parsing them
+        return documents_view_class()([harvester.kg for harvester in self.getHarvesters() if unparsed or harvester.unparsed is None])
     
     def getListDictsProfiles(self):
-        #first get the complete kg
-        c_kg = self.getCompleteKG()
+        #first get the complete kg, the crates read as json can not make profiles, they are only parsed when they describe one of them
+        c_kg = self.getCompleteKG(unparsed=False)
         #run query that will extract the triples that we need , check for each of the triples if they exist if not return empty string
-        query = '''
-        prefix prof: <http://www.w3.org/ns/dx/prof/>
-        prefix schema: <http://schema.org/>
-        select ?profile ?name ?description ?version ?keywords ?license where {
-            ?profile a prof:Profile .
-            OPTIONAL { ?profile schema:name ?name . }
-            OPTIONAL { ?profile schema:description ?description . }
-            OPTIONAL { ?profile schema:version ?version . }
-            OPTIONAL { ?profile schema:keywords ?keywords . }
-            OPTIONAL { ?profile schema:license ?license . }
-        }    
-        '''
-        results = c_kg.query(query)
+        results = run_query("profile_metadata", c_kg)
+        found = {str(result[0]) for result in results}
+        if any(found & harvester.described for harvester in self.getHarvesters() if harvester.unparsed is not None):
+            results = run_query("profile_metadata", self.getCompleteKG())
         toreturn = {}
         for result in results:
             p_dict = {}
@@ -0,0 +1,61 @@
+#this file will contain the catalog of the sparql queries in src/templates/*.sparql
+#the queries are parsed and compiled once per process with prepareQuery and then reused by every harvester
+#values are passed as initial bindings instead of being formatted into the query text
+import os
+import glob
+import time
+import threading
+from utils.singleton.location import singleton
+from utils.singleton.logger import get_logger
+from utils.lazy_import import lazy_import
+
+logger = get_logger()
+sparql = lazy_import("rdflib.plugins.sparql")
+
+TEMPLATES_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+@singleton
+class QueryCatalog():
+    def __init__(self, folder=TEMPLATES_FOLDER):
+        self.folder = folder
+        self.queries = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        for path in sorted(glob.glob(os.path.join(folder, "*.sparql"))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(path) as f:
+                self.queries[name] = sparql.prepareQuery(f.read())
+            self.stats[name] = {"count": 0, "time": 0.0}
+        logger.info(f"Prepared {len(self.queries)} sparql queries from {folder}")
+
+    def __repr__(self) -> str:
+        return f"QueryCatalog(folder={self.folder}, queries={list(self.queries)})"
+
+    def query(self, name, graph, **bindings):
+        '''
+        run a prepared query on a graph
+        :param name: the name of the query, the file name of the template without .sparql
+        :param graph: the graph to query
+        :param bindings: initial bindings of query variables, e.g. profile=URIRef(...)
+        :return: list of result rows
+        '''
+        start = time.perf_counter()
+        results = list(graph.query(self.queries[name], initBindings=bindings))
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.stats[name]["count"] += 1
+            self.stats[name]["time"] += elapsed
+        return results
+
+    def get_stats(self):
+        '''
+        get the number of executions and total execution time in seconds of every query
+        '''
+        with self.lock:
+            return {name: dict(stats) for name, stats in self.stats.items()}
+
+def run_query(name, graph, **bindings):
+    '''
+    run a prepared query from the shared catalog
+    '''
+    return QueryCatalog().query(name, graph, **bindings)
@@ -0,0 +1,178 @@
+#this file will contain the rate limiter that is shared by all the http calls
+#every host gets its own token bucket so unrelated hosts never wait on each other
+import os
+import time
+import threading
+import email.utils
+from urllib.parse import urlsplit
+from utils.singleton.location import singleton
+from utils.singleton.logger import get_logger
+from utils.httpclient import get_http_client
+from utils.instrumentation import get_metrics
+from utils.lazy_import import lazy_import
+from utils.deadlines import remaining
+
+logger = get_logger()
+requests = lazy_import("requests")
+
+#default number of requests per second and burst size for every host
+DEFAULT_RATE = float(os.environ.get("RATE_LIMIT_PER_SECOND", 5))
+DEFAULT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 5))
+#retries for 429/503 responses and connection errors
+DEFAULT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", 3))
+DEFAULT_BACKOFF = float(os.environ.get("RATE_LIMIT_BACKOFF", 0.5))
+#upper limit for a Retry-After delay, a host asking for more than this is not worth waiting for
+MAX_RETRY_AFTER = float(os.environ.get("RATE_LIMIT_MAX_RETRY_AFTER", 60))
+
+RETRY_STATUS_CODES = (429, 503)
+
+class TokenBucket():
+    '''
+    token bucket that allows `rate` requests per second with bursts of at most `capacity` requests
+    '''
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"TokenBucket(rate={self.rate}, capacity={self.capacity})"
+
+    def acquire(self):
+        '''
+        block until a token is available and take it
+        '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def block(self, seconds):
+        '''
+        hand out no tokens for the given amount of seconds, used when the host asks us to back off
+        '''
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+@singleton
+class RateLimiter():
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.buckets = {}
+        self.host_limits = {}
+        self.answered_hosts = set() #hosts that answered a request, only their connection errors are retried
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"RateLimiter(rate={self.rate}, capacity={self.capacity}, hosts={len(self.buckets)})"
+
+    def configure_host(self, host, rate, capacity=None):
+        '''
+        set a specific limit for a host, overriding the default limit
+        :param host: the host (netloc) of the uris to limit
+        :param rate: number of requests per second
+        :param capacity: burst size, defaults to the rate
+        '''
+        with self.lock:
+            self.host_limits[host] = (rate, capacity or max(1, int(rate)))
+            self.buckets.pop(host, None)
+
+    def get_bucket(self, uri):
+        host = urlsplit(str(uri)).netloc
+        with self.lock:
+            if host not in self.buckets:
+                rate, capacity = self.host_limits.get(host, (self.rate, self.capacity))
+                self.buckets[host] = TokenBucket(rate, capacity)
+            return self.buckets[host]
+
+    def get(self, uri, **kwargs):
+        '''
+        do a GET request once the host of the uri has a token available.
+        429 and 503 responses are retried after the Retry-After delay of the response,
+        connection errors and responses without Retry-After are retried with exponential backoff.
+        This is the only place requests are retried, the http client does not retry.
+        Connection errors of a host that did not answer any request yet are not retried, a host that is down should
+        only cost one timeout per uri until its circuit opens (see utils.failures)
+        :param uri: the uri to get
+        :param kwargs: extra arguments passed on to the http client
+        :return: the response of the last attempt
+        '''
+        bucket = self.get_bucket(uri)
+        host = urlsplit(str(uri)).netloc
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            bucket.acquire()
+            requested = time.perf_counter()
+            metrics.count("rate_limit_wait", requested - start, host=host)
+            metrics.count("http_requests", host=host)
+            try:
+                response = get_http_client().get(uri, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.count("http_errors", host=host)
+                metrics.count("http_time", time.perf_counter() - requested, host=host)
+                if attempt >= self.max_retries or host not in self.answered_hosts:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Request to {uri} failed ({e}), retrying in {delay}s")
+                bucket.block(delay)
+                attempt += 1
+                continue
+            metrics.count("http_time", time.perf_counter() - requested, host=host)
+            metrics.count("bytes_downloaded", len(response.content), host=host)
+            self.answered_hosts.add(host)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = self.backoff * 2 ** attempt
+            left = remaining()
+            if delay > MAX_RETRY_AFTER or (left is not None and delay >= left):
+                logger.warning(f"{uri} asked to retry after {delay}s, giving up")
+                return response
+            logger.warning(f"{uri} returned {response.status_code}, retrying in {delay}s")
+            bucket.block(delay)
+            attempt += 1
+
+def retry_after(response):
+    '''
+    get the delay in seconds from the Retry-After header of a response
+    :param response: the response to check
+    :return: the delay in seconds or None if the header is missing or can not be parsed
+    '''
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+def rate_limited_get(uri, **kwargs):
+    '''
+    do a GET request through the shared rate limiter
+    :param uri: the uri to get
+    :param kwargs: extra arguments passed on to the http client
+    :return: the response
+    '''
+    return RateLimiter().get(uri, **kwargs)
@@ -5,12 +5,21 @@ from rdflib.namespace import DC, FOAF, RDF, RDFS, XSD
 import os
 import sys
 import json 
-import requests
 #logger
 from utils.singleton.logger import get_logger
 from utils.singleton.location import Location
+from utils.httpcache import cached_get
+from utils.instrumentation import Lazy, get_metrics
+from utils.parsepool import get_parse_pool
 
 logger = get_logger()
+
+#schema.org properties that are extracted from every profile in the registry
+METADATA_PROPERTIES = {
+    URIRef("http://schema.org/" + name): name
+    for name in ["name", "description", "author", "dateCreated", "dateModified", "version", "license", "keywords"]
+}
+
 class KnowledgeGraphRegistry():
     
     def __init__(self, base, knowledgeGraph=None):
@@ -60,7 +69,11 @@ class KnowledgeGraphRegistry():
         try:
             #first add the uri as rdf type schema:CreativeWork , schema:LisItem
             #self.knowledgeGraph.add((URIRef(profile_uri), RDF.type, URIRef("http://schema.org/CreativeWork")))
-            self.knowledgeGraph.parse(format="json-ld", location=URIRef(profile_uri))
+            response = cached_get(profile_uri, headers={"Accept": "application/ld+json"})
+            response.raise_for_status()
+            before = len(self.knowledgeGraph)
+            get_parse_pool().parse(self.knowledgeGraph, response.text, "json-ld", publicID=profile_uri)
+            get_metrics().count("triples_parsed", len(self.knowledgeGraph) - before)
             self.knowledgeGraph.add((URIRef(profile_uri), RDF.type, URIRef("http://schema.org/ListItem")))
             self.knowledgeGraph.add((URIRef(profile_uri), URIRef("http://schema.org/item"), URIRef(profile_uri)))
             
@@ -93,66 +106,61 @@ class KnowledgeGraphRegistry():
         metadata = {}
         #get all the profiles in the registry
         profiles = self.knowledgeGraph.objects(BNode("listregistry"), URIRef("http://schema.org/itemListElement"))
-        #iterate over all the profiles
+        #iterate over all the profiles, every profile costs one scan of its own triples
         for profile in profiles:
             #get the metadata from the profile
-            metadata[profile] = self.getMetadata(profile)
+            metadata[profile] = self.getMetadata(profile, self.profileValues(profile))
         #log json metadata in pprint format
-        logger.debug(msg="Metadata extracted from all profiles in the registry: \n{0}".format(json.dumps(metadata, indent=4)))
+        logger.debug("Metadata extracted from all profiles in the registry: \n%s", Lazy(json.dumps, metadata, indent=4))
         return metadata
     
-    def getMetadata(self, profile_uri):
+    def getMetadata(self, profile_uri, values=None):
         '''
         this function will extract metadata from a profile
+        :param profile_uri: the uri of the profile
+        :param values: the values of the profile grouped per property as made by profileValues, looked up when not given
         '''
         logger.info(msg="Extracting metadata from profile {0}".format(profile_uri))
+        if values is None:
+            values = self.profileValues(profile_uri)
         #create a dictionary to store the metadata
         metadata = {}
-        #get the name of the profile
-        metadata["name"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/name"))
-        #get the description of the profile
-        metadata["description"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/description"))
-        #get the authors of the profile, this can be a list of authors or a single author
-        all_authors = self.knowledgeGraph.query("""SELECT ?authors WHERE {
-            <%s> <http://schema.org/author> ?authors .
-        }""" % profile_uri)
-        #if there is more than one author
-        if len(all_authors) > 1:
-            #create a list to store the authors
-            authorse = []
-            #iterate over all the authors
-            for row in all_authors:
-                #add the author to the list
-                authorse.append(row.authors)
-            #add the list of authors to the metadata
-            metadata["author"] = authorse
+        metadata["name"] = first(values["name"])
+        metadata["description"] = first(values["description"])
+        #the authors of the profile, this can be a list of authors or a single author
+        if len(values["author"]) > 1:
+            metadata["author"] = values["author"]
         else:
-            metadata["author"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/author"))
-        #get the dateCreated of the profile
-        metadata["dateCreated"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/dateCreated"))
-        #get the dateModified of the profile
-        metadata["dateModified"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/dateModified"))
-        #get the version of the profile
-        metadata["version"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/version"))
-        #get the license of the profile
-        metadata["license"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/license"))
-        #get the keywords of the profile this can be a list of keywords or a single keyword
-        #perform sparql query to get all the keywords
-        all_keywords = self.knowledgeGraph.query("""SELECT ?keywords WHERE {
-            <%s> <http://schema.org/keywords> ?keywords .
-        }""" % profile_uri)
-        metadata["keywords"] = []
-        if len(all_keywords) > 1:
-            #iterate over all the keywords
-            for keyworde in all_keywords:
-                metadata["keywords"].append(keyworde.keywords)
+            metadata["author"] = first(values["author"])
+        metadata["dateCreated"] = first(values["dateCreated"])
+        metadata["dateModified"] = first(values["dateModified"])
+        metadata["version"] = first(values["version"])
+        metadata["license"] = first(values["license"])
+        #the keywords of the profile, this can be a list of keywords or a single keyword
+        if len(values["keywords"]) > 1:
+            metadata["keywords"] = values["keywords"]
             #get the url of the profile
             metadata["url"] = profile_uri
         else:
-            metadata["keywords"] = self.knowledgeGraph.value(profile_uri, URIRef("http://schema.org/keywords"))
+            metadata["keywords"] = first(values["keywords"])
         #log json metadata in pprint format
-        logger.debug(msg="Metadata extracted from profile {0}: \n{1}".format(profile_uri, json.dumps(metadata, indent=4)))
+        logger.debug("Metadata extracted from profile %s: \n%s", profile_uri, Lazy(json.dumps, metadata, indent=4))
         return metadata
     
-    
-    
\ No newline at end of file
+    def profileValues(self, profile_uri):
+        '''
+        get the values of all the metadata properties of a profile in one scan of the triples of the profile
+        :param profile_uri: the uri of the profile
+        :return: dict of property name to the list of its values
+        '''
+        values = {name: [] for name in METADATA_PROPERTIES.values()}
+        for predicate, value in self.knowledgeGraph.predicate_objects(profile_uri):
+            if predicate in METADATA_PROPERTIES:
+                values[METADATA_PROPERTIES[predicate]].append(value)
+        return values
+
+def first(values):
+    '''
+    the first value of a list or None for an empty list, like Graph.value does for a single property
+    '''
+    return values[0] if values else None
@@ -1,38 +1,75 @@
 #this file will contain all the functions that will be used to build the registry that will be used to build the gh-pages
 import os
-import csv
 import json
-import rdflib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from utils.singleton.location import Location
 from utils.singleton.logger import get_logger, get_warnings_log
-from utils.uri_checks import check_uri, check_if_json_return, get_url, check_uri_content
+from utils.uri_checks import check_uri, check_if_json_return, get_url, check_uri_content, fetch_valid_uri
 from utils.jsonld_file import has_conformsTo_prop, get_cornformTo_uris, is_profile, get_profile_prop, get_metadata_profile
-from utils.html_build_util import make_html_file, setup_build_folder
-from utils.rdflib_utils import KnowledgeGraphRegistry
+from utils.html_build_util import setup_build_folder, ShardWriter
 from utils.contact import Contact
-from utils.profileharvester import ProfileHarvester
+from utils.csv_scanner import scan_files, read_rows
+from utils.profileharvester import ProfileHarvester, accept_header
+from utils.resolution_cache import ResolutionCache, normalise_uri
+from utils.crawler import Crawler
+from utils.httpcache import HttpCache, failure_reason
+from utils.queries import QueryCatalog
+from utils.instrumentation import Lazy, write_artifact, artifact_name, get_metrics, in_context, PROMETHEUS_FILE
+from utils.manifest import BuildManifest
+from utils.parsepool import get_parse_pool
+from utils.deadlines import DeadlineExceeded, DEFAULT_BUILD_BUDGET, deadline_after, deadline_at, expired
+from utils.lazy_import import lazy_import
 logger = get_logger()
+#the registry knowledge graph needs rdflib, it is only loaded when the graph is made
+rdflib_utils = lazy_import("utils.rdflib_utils")
+asyncio = lazy_import("asyncio")
+
+#maximum number of entries that are fetched at the same time while harvesting
+MAX_HARVEST_CONCURRENCY = int(os.environ.get("HARVEST_CONCURRENCY", 8))
+#registries with more profiles than this get paginated listing pages and a detail page per profile, 0 always makes one page
+HTML_PAGE_SIZE = int(os.environ.get("HTML_PAGE_SIZE", 500))
+#pages of the site in the build folder, they are kept between builds and only rewritten when they changed
+SITE_PAGES = ("index.html", "pages", "profiles", "profiles.json")
+#number of csv rows that are read and checked at a time, the rows are streamed from the csv files in batches of this size
+CHECK_BATCH_SIZE = int(os.environ.get("CHECK_BATCH_SIZE", 256))
+#response of check_entry_uri for the URIs that were not checked because the build budget ran out
+DEFERRED = object()
 
 #registry class that will hold the registry
 class Registry():
-    def __init__(self, data_path, registry=None):
+    def __init__(self, data_path, registry=None, max_concurrency=MAX_HARVEST_CONCURRENCY, build_budget=DEFAULT_BUILD_BUDGET):
         self.registry = registry
+        self.max_concurrency = max_concurrency
+        self.build_budget = build_budget #seconds the check and the harvest may take, see utils.deadlines
+        self.deadline = None
         self.entry_errors = []
         self.entry_warnings = []
+        self.deferred_entries = [] #entries that were left for a next build because the build budget ran out
         self.to_check_rows = []
         self.checked_rows = []
         self.data_path = data_path
         self.profile_registry_array = []
-        self.knowledge_graph_registry = KnowledgeGraphRegistry(base="test",knowledgeGraph=None)
+        self._knowledge_graph_registry = None
+        #manifest of the previous build, rows that did not change since are not harvested again
+        self.manifest = BuildManifest()
     
     def __repr__(self) -> str:
         return f"Registry(registry={self.registry})"
     
+    @property
+    def knowledge_graph_registry(self):
+        #made on first use, so checking the entries does not load rdflib
+        if self._knowledge_graph_registry is None:
+            self._knowledge_graph_registry = rdflib_utils.KnowledgeGraphRegistry(base="test",knowledgeGraph=None)
+        return self._knowledge_graph_registry
+    
     def report(self):
         logger.info("Generating report")
         report = {}
         report["entry_errors"] = self.entry_errors
         report["entry_warnings"] = self.entry_warnings
+        report["deferred_entries"] = self.deferred_entries
         report["to_check_rows"] = self.to_check_rows
         report["checked_rows"] = self.checked_rows
         report["profile_registry_array"] = self.profile_registry_array
@@ -67,19 +104,42 @@ class Registry():
         '''
         
         logger.info("Building registry")
-        #function here to detect all the csv files in the data_path including subfolders
-        self.csv_files = self.detect_csv_files()
-        logger.info(f"Found {len(self.csv_files)} csv files")
-        #function that will go over all the csv files and return an array of dictionaries with each entry in the array being {"source": "relative path to csv file", "URI": "URI of a given profile", "contact":"contact" }
-        self.registry_array = self.make_entries_array()
-        self.entries_array_check()
-        self.entries_harvestor()
-        #self.get_metadata_profiles()
-        setup_build_folder()
-        self.knowledge_graph_registry.toTurtle()
-        #write the knowledge graph to a ttl file
-        self.registry_json_format = self.knowledge_graph_registry.extractMetadata()
-        self.make_html_file_registry()
+        #every stage is timed and the http requests, bytes and triples it causes are counted, see build/metrics.json
+        self.metrics = get_metrics()
+        self.metrics.reset()
+        #every document is fetched once per build, not once per process
+        HttpCache().clear_memory()
+        #the entries that are not checked and harvested within the budget are deferred instead of holding up the build
+        self.deadline = deadline_after(self.build_budget)
+        try:
+            #the manifest is kept next to the http cache, outside of the published build folder
+            self.manifest.load()
+            #function here to detect all the csv files in the data_path including subfolders
+            with self.metrics.stage("detect_csv_files"):
+                self.csv_files = self.detect_csv_files()
+            logger.info(f"Found {len(self.csv_files)} csv files")
+            #the rows of the csv files are read, checked and harvested as a pipeline, see entries_harvestor
+            with self.metrics.stage("entries_harvestor"):
+                self.entries_harvestor(self.iter_entries())
+            #self.get_metadata_profiles()
+            setup_build_folder(keep=SITE_PAGES)
+            with self.metrics.stage("save_manifest"):
+                self.manifest.save(self.resolution_cache.dataset, self.resolution_cache.unparsed_documents())
+            with self.metrics.stage("toTurtle"):
+                self.knowledge_graph_registry.toTurtle()
+            #write the knowledge graph to a ttl file
+            with self.metrics.stage("extractMetadata"):
+                self.registry_json_format = self.knowledge_graph_registry.extractMetadata()
+            with self.metrics.stage("make_html_file_registry"):
+                self.make_html_file_registry()
+            logger.info(f"Sparql query statistics: {QueryCatalog().get_stats()}")
+            report = self.metrics.write(os.path.join(Location().get_location(), "build"), prometheus_file=PROMETHEUS_FILE)
+            logger.info("Build metrics: %s", Lazy(json.dumps, {"duration": report["duration"], "totals": report["totals"]}))
+        finally:
+            #the parse workers are not left running until the interpreter exits
+            get_parse_pool().shutdown()
+            #the lru order of the http cache is saved once per build instead of on every response
+            HttpCache().flush()
 
     def detect_csv_files(self):
         '''
@@ -88,61 +148,151 @@ class Registry():
         :return: the list of csv files
         '''
         logger.info("Detecting csv files")
-        csv_files = []
-        for root, dirs, files in os.walk(self.data_path):
-            for file in files:
-                if file.endswith(".csv"):
-                    csv_files.append(os.path.join(root, file))
-        return csv_files
+        #.git and the other pruned directories are not walked, see utils.csv_scanner
+        return list(scan_files(self.data_path))
     
-    def entries_harvestor(self):
+    def entries_harvestor(self, entries):
         '''
         This function will make a harvestor class for each entry in the registry_array.
+        The harvestors run concurrently, the results are merged in the order of the entries so the build output is deterministic.
+        :param entries: the entries to check and harvest, see iter_entries. Every checked batch is harvested while the next one is checked
         '''
         logger.info("Making harvestors")
         self.profile_metadate_dicts = {}
+        #the parse workers are forked before the harvester threads exist
+        get_parse_pool().start()
+        harvested_rows = {id(entry) for entry in asyncio.run(self.harvest_entries(self.check_batches(entries)))}
+        logger.info(f"Harvested {len(harvested_rows)} of {len(self.to_check_rows)} entries, the others did not change since the previous build or failed")
         for entry in self.to_check_rows:
-            logger.info(f"Making harvestor for {entry['URI']}")
-            entry_harvestor = ProfileHarvester(entry["URI"])
-            entry_harvestor.harvest()
-            entry["harvestor"] = entry_harvestor
-            logger.debug(entry_harvestor.get_kg())
+            if id(entry) not in harvested_rows:
+                if self.manifest.is_fresh(entry):
+                    logger.info(f"Reusing the previous build for {entry['URI']}")
+                    harvested_info = self.manifest.restore(entry, self.resolution_cache.dataset)
+                    for uri in sorted(harvested_info):
+                        self.profile_metadate_dicts[uri] = harvested_info[uri]
+                continue
+            entry_harvestor = entry["harvestor"]
             logger.info(f"Harvestor for {entry['URI']} has run")
             logger.info(f"Harvester has found {len(entry_harvestor.getProfiles())} profiles")
-            logger.debug(entry_harvestor.getCompleteKG().serialize(format = "turtle", base=entry['URI'], encoding="utf-8").decode("utf-8"))
-            logger.info(f"Harvestor for {entry['URI']} has run")
+            #the complete kg is only serialized when debug logging is on, and then to a file instead of the log
+            write_artifact(logger, artifact_name(entry["URI"], "kg.ttl"), lambda: entry_harvestor.getCompleteKG().serialize(format="turtle", base=entry["URI"]))
             harvested_info = entry_harvestor.getListDictsProfiles()
             #ppritn the harvested info
-            logger.info(json.dumps(harvested_info, indent=4))
-            self.profile_metadate_dicts.update(harvested_info)
+            logger.debug("%s", Lazy(json.dumps, harvested_info, indent=4))
+            #a row with documents that could not be fetched is harvested again by the next build instead of reusing what was missing
+            failed_documents = [str(harvester.entry_uri) for harvester in entry_harvestor.getHarvesters() if harvester.fetch_failed or harvester.harvest_error is not None]
+            if failed_documents and not entry.get("incomplete"):
+                entry["incomplete"] = True
+                self.entry_warning(entry, reason=f"{len(failed_documents)} of the documents it links to could not be harvested: {', '.join(failed_documents[:5])}")
+            if not entry.get("incomplete"):
+                self.manifest.record(entry, entry_harvestor, harvested_info)
+            for uri in sorted(harvested_info):
+                #keyed by str like the profiles restored from the manifest, so a profile found by both is only listed once
+                self.profile_metadate_dicts[str(uri)] = harvested_info[uri]
     
-    def make_entries_array(self):
+    async def harvest_entries(self, batches):
         '''
-        this function will go over all the csv files and return an array of dictionaries with each entry in the array being {"source": "relative path to csv file", "URI": "URI of a given profile", "contact":"contact" }
-        :param csv_files: the list of csv files
-        :return: the array of dictionaries
+        harvest the entries and everything they link to with a crawler of max_concurrency workers.
+        The entries of a batch are handed to the crawler as soon as the batch is checked, the next batch is checked in a thread meanwhile
+        :param batches: iterator of lists of checked entries, see check_batches
+        :return: the entries that were harvested successfully, in the order they were checked
         '''
-        logger.info("Making registry array")
-        registry_array = []
-        try:
-            for csv_file in self.csv_files:
-                logger.info(f"Reading csv file {csv_file}")
-                with open(csv_file, newline='') as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        registry_array.append({"source": csv_file, "URI": row["URI"], "contact": Contact(row["contact"])})
-        except Exception as e:
-            logger.error(f"Error while making registry array: {e}")
-        return registry_array
+        #all the entries and their children share one resolution cache so every uri is only harvested once
+        self.resolution_cache = ResolutionCache()
+        self.crawler = Crawler(max_concurrency=self.max_concurrency, deadline=self.deadline)
+        self.crawler.start()
+        rows = []
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            #rows that did not change since the previous build are spliced in from the manifest instead of being harvested
+            for entry in batch:
+                if self.manifest.is_fresh(entry):
+                    entry.pop("response", None)
+                    continue
+                logger.info(f"Making harvestor for {entry['URI']}")
+                #the response of the uri check is handed to the harvester so the uri is not fetched again, the harvester drops it once it is parsed
+                #an entry that an earlier entry already links to keeps the harvester of that link
+                response = entry.pop("response", None)
+                entry["harvestor"], created = self.resolution_cache.get_or_create(
+                    entry["URI"],
+                    lambda: ProfileHarvester(entry["URI"], resolution_cache=self.resolution_cache, response=response)
+                )
+                if created:
+                    self.crawler.enqueue(entry["harvestor"])
+                rows.append(entry)
+        await self.crawler.finish()
+        harvested_rows = []
+        for entry in rows:
+            error = entry["harvestor"].harvest_error
+            if entry["harvestor"].deferred or (isinstance(error, DeadlineExceeded) and expired(self.deadline)):
+                self.entry_deferred(entry, reason="the build budget ran out before it was harvested")
+                continue
+            if error is not None:
+                self.entry_failed(entry, reason=f"harvesting failed: {error}")
+                continue
+            if entry["URI"] in self.crawler.incomplete_entries:
+                #the documents that were harvested are used, the entry is harvested again by the next build
+                entry["incomplete"] = True
+                self.entry_warning(entry, reason="not all the documents it links to were harvested in time")
+            harvested_rows.append(entry)
+        return harvested_rows
     
-    def entries_array_check(self):
+    def iter_entries(self):
         '''
-        this function will make the registry
-        :param registry_array: the array of dictionaries
-        :return: the registry
+        read the entries of all the csv files one row at a time, every entry is {"source": "relative path to csv file", "URI": "URI of a given profile", "contact": Contact}.
+        A csv file that can not be read is skipped and a row without URI or contact is added to entry_errors, the other rows are still read
+        :return: generator of the entries
+        '''
+        for csv_file, line, row in read_rows(self.csv_files):
+            if not row["URI"] or row["contact"] is None:
+                self.entry_failed({"source": csv_file, "line": line, "URI": row["URI"], "contact": row["contact"]}, reason=f"line {line} of csv file {csv_file} has no URI or contact")
+                continue
+            yield {"source": csv_file, "URI": row["URI"], "contact": Contact(row["contact"])}
+    
+    def check_batches(self, entries):
+        '''
+        check the entries in batches of CHECK_BATCH_SIZE, so they can be streamed from the csv files and harvested while the next batch is checked.
+        The URIs are checked concurrently with at most max_concurrency requests at the same time, every URI only once.
+        The check is done with the Accept header of the harvester so the response is handed to the harvester instead of being fetched again.
+        :param entries: the entries to check, see iter_entries
+        :return: generator of the lists of valid entries of every batch
         '''
         logger.info("Checking registry array")
-        for entry in self.registry_array:
+        entries = iter(entries)
+        #only the URIs that are not valid are remembered between batches, the responses are handed to the entries
+        failed_uris = set()
+        #index of the normalised URIs that are already in the registry
+        registry_uris = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while True:
+                #the checks are timed as their own stage, it overlaps the harvest of the previous batches
+                with get_metrics().stage("entries_array_check"):
+                    batch = list(itertools.islice(entries, CHECK_BATCH_SIZE))
+                    if not batch:
+                        break
+                    #rows that did not change since the previous build were valid then and are not fetched again,
+                    #their documents are revalidated concurrently and the outcome is remembered for the harvest
+                    fresh = list(executor.map(in_context(self.check_fresh), batch))
+                    batch_uris = dict.fromkeys(entry["URI"] for entry, is_fresh in zip(batch, fresh) if not is_fresh)
+                    unique_uris = [uri for uri in batch_uris if uri not in failed_uris]
+                    responses = dict.fromkeys(failed_uris.intersection(batch_uris))
+                    responses.update(zip(unique_uris, executor.map(in_context(self.check_entry_uri), unique_uris)))
+                    failed_uris.update(uri for uri, response in responses.items() if response is None)
+                    valid_entries = self.check_entries(batch, responses, registry_uris)
+                yield valid_entries
+    
+    def check_entries(self, entries, responses, registry_uris):
+        '''
+        check the contact of the entries and if their URI is valid and not in the registry yet, the valid entries are added to to_check_rows
+        :param entries: the entries to check
+        :param responses: the response of every checked URI, None when the URI is not valid
+        :param registry_uris: the entries already in the registry by normalised URI, the valid entries are added to it
+        :return: the valid entries
+        '''
+        valid_entries = []
+        for entry in entries:
+            if responses.get(entry["URI"]) is DEFERRED:
+                self.entry_deferred(entry, reason="the build budget ran out before its URI was checked")
+                continue
             #first check if the contact is valid
             good = True
             logger.debug(f"Checking contact {entry['contact'].get_contact()}")
@@ -152,18 +302,40 @@ class Registry():
             logger.info(f"Checking entry {entry}")
             #check if the URI is valid
             #check if the URI is already in the registry
-            for row  in self.to_check_rows:
-                if entry["URI"] == row["URI"]:
-                    self.entry_warning(entry, reason="URI is already in registry")
-                    good = False
-                    break
-            if not check_uri(entry["URI"]):
-                self.entry_failed(entry, reason="URI is not valid")
+            if normalise_uri(entry["URI"]) in registry_uris:
+                self.entry_warning(entry, reason="URI is already in registry")
+                good = False
+            if entry["URI"] in responses and responses[entry["URI"]] is None:
+                #a URI on a failing host is not fetched at all, the reason tells it apart from a URI that answered with an error
+                self.entry_failed(entry, reason=failure_reason(entry["URI"]) or "URI is not valid")
                 good = False
             #check if the URI return a valid json-ld
             if good:
-                self.to_check_rows.append(entry)     
+                entry["response"] = responses.get(entry["URI"])
+                registry_uris[normalise_uri(entry["URI"])] = entry
+                self.to_check_rows.append(entry)
+                valid_entries.append(entry)
+        return valid_entries
     
+    def check_fresh(self, entry):
+        '''
+        check if an entry can be reused from the previous build, its documents are revalidated within the build budget
+        '''
+        with get_metrics().entry(entry["URI"]), deadline_at(self.deadline):
+            return self.manifest.is_fresh(entry)
+
+    def check_entry_uri(self, uri):
+        '''
+        fetch the URI of an entry with the Accept header of the harvester
+        :return: the response, None when the URI is not valid or DEFERRED when the build budget ran out
+        '''
+        if expired(self.deadline):
+            return DEFERRED
+        with get_metrics().entry(uri), deadline_at(self.deadline):
+            response = fetch_valid_uri(uri, headers={"Accept": accept_header()})
+        #a check that was cut short by the budget does not make the URI invalid
+        return DEFERRED if response is None and expired(self.deadline) else response
+
     def get_metadata_profiles(self):
         logger.info("Getting metadata profiles")
         for row in self.profile_registry_array:
@@ -185,12 +357,34 @@ class Registry():
                 "title": "Test Profile registry",
                 "description": "This is a test profile registry",
                 "theme": "main",
-                "datasets": self.profile_metadate_dicts
             }
-            html_file = make_html_file("index_registry.html",**kwargs)
-            #write the html file to the build folder
-            with open(os.path.join(Location().get_location(), "build", "index.html"), "w") as f:
-                f.write(html_file)
+            #pages whose template and data did not change since the previous build are not written again
+            writer = ShardWriter(os.path.join(Location().get_location(), "build"))
+            profiles = list(self.profile_metadate_dicts.items())
+            pages = {}
+            details = {}
+            if HTML_PAGE_SIZE <= 0 or len(profiles) <= HTML_PAGE_SIZE:
+                writer.write("index.html", "index_registry.html", datasets=self.profile_metadate_dicts, **kwargs)
+                pages = {uri: "index.html" for uri, metadata in profiles}
+            else:
+                #paginated listing pages and a detail page per profile
+                chunks = [profiles[i:i + HTML_PAGE_SIZE] for i in range(0, len(profiles), HTML_PAGE_SIZE)]
+                page_files = ["index.html"] + ["pages/{0}.html".format(number) for number in range(2, len(chunks) + 1)]
+                for number, chunk in enumerate(chunks, start=1):
+                    page_file = page_files[number - 1]
+                    root = "./" if number == 1 else "../"
+                    chunk_details = {uri: "profiles/" + artifact_name(uri, "html") for uri, metadata in chunk}
+                    writer.write(page_file, "index_registry.html", datasets=dict(chunk), details=chunk_details, pages=page_files, page=number, root=root, **kwargs)
+                    for uri, metadata in chunk:
+                        writer.write(chunk_details[uri], "profile.html", uri=uri, metadata=metadata, page_file=page_file, **kwargs)
+                        pages[uri] = page_file
+                    details.update(chunk_details)
+            #compact index of all the profiles for scripts and client side search
+            writer.write("profiles.json", count=len(profiles), profiles=[
+                {"uri": uri, "name": metadata.get("name"), "version": metadata.get("version"), "page": pages[uri], "detail": details.get(uri)}
+                for uri, metadata in profiles
+            ])
+            writer.finish()
         except Exception as e:
             logger.error(f"Error while making html file: {e}")
             logger.exception(e)
@@ -201,6 +395,12 @@ class Registry():
         logger.warning(f"Entry {uri} is not valid because {reason}")
         self.entry_warnings.append(entry)
     
+    def entry_deferred(self, entry, reason):
+        uri = entry["URI"]
+        logger.warning(f"Entry {uri} is deferred to a next build because {reason}")
+        get_metrics().count("entries_deferred")
+        self.deferred_entries.append(entry)
+    
     def entry_failed(self, entry, reason):
         uri = entry["URI"]
         logger.error(f"Entry {uri} is not valid because {reason}")
@@ -0,0 +1,93 @@
+#this file will contain the build wide cache of resolved uris
+#every uri is harvested once per build, harvesters that discover a uri that is already known reuse its harvester
+#this also stops cyclic references between registries from being followed forever
+#the harvested documents are stored as named graphs in one shared dataset, its default graph is the union of all documents
+import os
+import threading
+from urllib.parse import urlsplit, urlunsplit
+from utils.singleton.logger import get_logger
+from utils.lazy_import import lazy_import
+
+logger = get_logger()
+rdflib = lazy_import("rdflib")
+
+#maximum number of conformsTo/itemListElement hops that are followed from an entry
+DEFAULT_MAX_DEPTH = int(os.environ.get("HARVEST_MAX_DEPTH", 10))
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalise_uri(uri):
+    '''
+    normalise a uri so different spellings of the same document share one key.
+    The scheme and host are lowercased, default ports and fragments are dropped and an empty path becomes /
+    :param uri: the uri to normalise
+    :return: the normalised uri
+    '''
+    parts = urlsplit(str(uri).strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if parts.port is not None and DEFAULT_PORTS.get(scheme) == parts.port:
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path or "/"
+    return urlunsplit((scheme, netloc, path, parts.query, ""))
+
+class ResolutionCache():
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH):
+        self.max_depth = max_depth
+        self.resolved = {}
+        self.lock = threading.Lock()
+        self.dataset = rdflib.Dataset(default_union=True)
+        #the rdflib memory store is not thread safe, harvesters hold this lock while parsing into or querying the dataset
+        self.dataset_lock = threading.RLock()
+
+    def __repr__(self) -> str:
+        return f"ResolutionCache(max_depth={self.max_depth}, resolved={len(self.resolved)})"
+
+    def __len__(self):
+        return len(self.resolved)
+
+    def __contains__(self, uri):
+        return normalise_uri(uri) in self.resolved
+
+    def add(self, uri, harvester):
+        '''
+        register a harvester for a uri unless the uri is already known
+        :return: the harvester that is registered for the uri
+        '''
+        with self.lock:
+            return self.resolved.setdefault(normalise_uri(uri), harvester)
+
+    def get_or_create(self, uri, factory):
+        '''
+        get the harvester of a uri, making it with factory when the uri has not been seen during this build
+        :param uri: the uri to resolve
+        :param factory: function without arguments that makes a new harvester for the uri
+        :return: tuple of the harvester and True when it was made by this call
+        '''
+        key = normalise_uri(uri)
+        with self.lock:
+            if key in self.resolved:
+                return self.resolved[key], False
+            harvester = factory()
+            self.resolved[key] = harvester
+            return harvester, True
+
+    def unparsed_documents(self):
+        '''
+        get the json of the crates that were read as json and not parsed, see ProfileHarvester.kg
+        :return: dict of the name of their graph to their json
+        '''
+        with self.lock:
+            harvesters = list(self.resolved.values())
+        return {str(harvester.document_graph.identifier): harvester.unparsed for harvester in harvesters if harvester.unparsed is not None}
+
+    def get(self, uri):
+        return self.resolved.get(normalise_uri(uri))
+
+    def document_graph(self, uri):
+        '''
+        get the named graph of a harvested document in the shared dataset
+        :param uri: the uri of the document, used as the name of the graph
+        '''
+        with self.dataset_lock:
+            return self.dataset.graph(rdflib.URIRef(uri))
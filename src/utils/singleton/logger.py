@@ -1,11 +1,17 @@
 import logging
-import inspect
+import sys
 import os
 from utils.singleton.location import Location
+
+#log level of all the loggers, e.g. LOG_LEVEL=INFO to skip the debug output and the debug artifacts
+LOG_LEVEL = logging.getLevelName(os.environ.get("LOG_LEVEL", "DEBUG").upper())
+if not isinstance(LOG_LEVEL, int):
+    LOG_LEVEL = logging.DEBUG
+
 class SingletonLogger(logging.Logger):
     _instance = None
     __initialized = False
-    def __init__(self, name=None, level=logging.DEBUG):
+    def __init__(self, name=None, level=LOG_LEVEL):
         if not self.__initialized:
             self.__initialized = True
             super().__init__(name=name, level=level)
@@ -45,9 +51,8 @@ def get_errors_log():
             
 def get_logger():
     # Get the name of the calling module
-    frame = inspect.stack()[1]
-    module = inspect.getmodule(frame[0])
-    module_name = module.__name__
+    # only the globals of the calling frame are read, inspect.stack() would build frame records with source lines for the whole stack
+    module_name = sys._getframe(1).f_globals.get("__name__", "__main__")
 
     # Create a logger instance with the module name as its name
     logger = SingletonLogger(module_name)
@@ -1,33 +1,42 @@
 # this utility file will contain all the functions that will be used to check the URI
 
-import requests
-import re
 import json
-import time
 from utils.singleton.location import Location
 from utils.singleton.logger import get_logger
+from utils.httpcache import cached_get
+from utils.html_head import describedby_links
 
 logger = get_logger()
 
 #function to check if the URI is valid
-def check_uri(uri):
+def check_uri(uri, headers=None):
     '''
     this function will check if the URI is valid
     :param uri: the URI to check
+    :param headers: optional request headers, e.g. the Accept header the response will be used with
     :return: True if valid, False if not
     '''
+    return fetch_valid_uri(uri, headers=headers) is not None
+
+def fetch_valid_uri(uri, headers=None):
+    '''
+    this function will check if the URI is valid and return the response so it does not have to be fetched again
+    :param uri: the URI to check
+    :param headers: optional request headers, e.g. the Accept header the response will be used with
+    :return: the response if valid, None if not
+    '''
     logger.info(f"Checking URI status code :{uri}")
     try:
-        response = get_url(uri)
+        response = cached_get(uri, headers=headers)
         if response.status_code == 200:
             logger.info(f"URI {uri} is valid")
-            return True
+            return response
         else:
             logger.error(f"URI {uri} is not valid")
-            return False
+            return None
     except Exception as e:
         logger.error(f"URI {uri} is not valid")
-        return False
+        return None
 
 def check_if_json_return(uri):
     '''
@@ -53,8 +62,7 @@ def check_if_json_return(uri):
         return False
 
 def get_url(uri):
-    time.sleep(0.3)
-    return requests.get(uri)
+    return cached_get(uri)
 
 def check_uri_content(uri):
     '''
@@ -63,14 +71,14 @@ def check_uri_content(uri):
     if it is not valid it will send out a request with the response header set to application/json and check if the response is valid
     if not send out a normal request and check if the response is valid
     if valid then check in the head of the html of there is a <link href="./ro-crate-metadata.json" rel="describedby" type="application/ld+json"> tag
-    the href of this tag will become the new uri
+    the href of this tag, resolved against the uri of the page, will become the new uri
     :param uri: the uri to check
     :return: True/False or the new uri to check
     '''
     logger.info(f"Checking URI content :{uri}")
     try:
         #do the call with requests header set to application/ld+json
-        response = requests.get(uri, headers={'Accept': 'application/ld+json'})
+        response = cached_get(uri, headers={'Accept': 'application/ld+json'})
         logger.debug(response.headers['content-type'])
         if "application/ld+json" in response.headers['content-type']:
             return True
@@ -78,15 +86,14 @@ def check_uri_content(uri):
         if "application/json" in response.headers['content-type']:
             return True
         #do the call with no requests header
-        response = requests.get(uri)
+        response = cached_get(uri)
         if response.status_code == 200:
             #check if the html contains a <link href="./ro-crate-metadata.json" rel="describedby" type="application/ld+json"> tag
-            #./ro-crate-metadata.json can be anything so regex will be used even htts://www.google.com/ro-crate-metadata.json
-            regex = r"<link href=\"(.*)\" rel=\"describedby\" type=\"application/ld\+json\">"
-            matches = re.finditer(regex, response.text, re.MULTILINE)
-            for matchNum, match in enumerate(matches, start=1):
-                logger.info(f"URI {uri} contains a <link href=\"{match.group(1)}\" rel=\"describedby\" type=\"application/ld+json\"> tag")
-                return match.group(1)
+            #./ro-crate-metadata.json can be anything, even https://www.google.com/ro-crate-metadata.json
+            for href, link_type in describedby_links(response):
+                if link_type == "application/ld+json":
+                    logger.info(f"URI {uri} contains a <link href=\"{href}\" rel=\"describedby\" type=\"application/ld+json\"> tag")
+                    return href
             logger.error(f"URI {uri} does not contain a <link href=\"./ro-crate-metadata.json\" rel=\"describedby\" type=\"application/ld+json\"> tag")
             return False
         else:
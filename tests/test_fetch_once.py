@@ -0,0 +1,123 @@
+#this file will test that every document is fetched once per build
+#the registry is served by the synthetic registry of the benchmark and the requests are counted by a client injected with set_http_client
+#usage: python tests/test_fetch_once.py
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SRC_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), "src")
+BENCHMARK_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), "benchmark")
+WORKDIR = tempfile.mkdtemp(prefix="registry-test-")
+#removed when the interpreter exits, the http cache is shared by the test files when they run in one process
+atexit.register(shutil.rmtree, WORKDIR, ignore_errors=True)
+#the settings of the harvester are read from the environment when its modules are imported
+os.environ.setdefault("HTTP_CACHE_DIR", os.path.join(WORKDIR, "cache", "http"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, SRC_FOLDER)
+sys.path.insert(0, BENCHMARK_FOLDER)
+
+from synthetic_registry import SyntheticRegistry
+from utils.singleton.location import Location
+from utils.httpcache import HttpCache
+from utils.httpclient import HttpClient, set_http_client
+from utils.ratelimiter import RateLimiter
+from utils.manifest import BuildManifest
+from utils.registry import Registry
+
+class CountingClient():
+    '''
+    http client that counts the requests per uri before handing them to the real client
+    '''
+    def __init__(self, client):
+        self.client = client
+        self.requests = Counter()
+
+    def get(self, uri, **kwargs):
+        self.requests[uri] += 1
+        return self.client.get(uri, **kwargs)
+
+class TestFetchOnce(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SyntheticRegistry(rows=20, fanout=3, depth=1, profiles=8, describedby=0.5)
+        cls.server.start()
+        RateLimiter().configure_host(cls.server.base.split("://")[1], 1000)
+        shutil.copytree(os.path.join(SRC_FOLDER, "templates"), os.path.join(WORKDIR, "templates"))
+        os.makedirs(os.path.join(WORKDIR, "data"))
+        with open(os.path.join(WORKDIR, "data", "registry.csv"), "w") as f:
+            f.write(cls.server.csv())
+        Location().root = WORKDIR
+        cls.previous_client = set_http_client(None)
+
+    @classmethod
+    def tearDownClass(cls):
+        set_http_client(cls.previous_client)
+        cls.server.stop()
+
+    def setUp(self):
+        #the synthetic registry counts the requests of every test on its own
+        self.server.requests.clear()
+
+    def build(self, manifest_folder=None):
+        '''
+        build the registry with a counting client, without a manifest folder the rows are always harvested again
+        :param manifest_folder: folder of the build manifest to reuse rows from
+        :return: the registry and the requests per uri
+        '''
+        client = CountingClient(HttpClient())
+        set_http_client(client)
+        registry = Registry(data_path=os.path.join(WORKDIR, "data"))
+        if manifest_folder:
+            registry.manifest = BuildManifest(folder=manifest_folder)
+        else:
+            registry.manifest.ttl = 0
+        registry.build()
+        return registry, client.requests
+
+    def test_every_document_is_fetched_once_per_build(self):
+        registry, requests = self.build()
+        self.assertEqual(len(registry.entry_errors), 0)
+        self.assertGreater(len(registry.profile_metadate_dicts), 0)
+        self.assertGreater(len(requests), self.server.rows)
+        self.assertEqual({uri: count for uri, count in requests.items() if count > 1}, {})
+        self.assertEqual({path: count for path, count in self.server.requests.items() if count > 1}, {})
+
+        #a second build in the same process revalidates every document once instead of answering from memory
+        registry, second_requests = self.build()
+        self.assertEqual(len(registry.entry_errors), 0)
+        self.assertEqual(set(second_requests), set(requests))
+        self.assertEqual({uri: count for uri, count in second_requests.items() if count > 1}, {})
+        self.assertEqual(registry.metrics.report()["totals"].get("cache_revalidated"), len(requests))
+
+    def test_documents_without_validators_are_fetched_once_over_the_memory_limit(self):
+        #without an ETag the documents are not written to the http cache, the ones dropped from memory are spilled to the disk
+        cache = HttpCache()
+        manifest_folder = tempfile.mkdtemp(dir=WORKDIR)
+        memory_size = cache.memory_size
+        profile = self.server.profile
+        self.server.etags = False
+        try:
+            self.build(manifest_folder)
+            #the profiles changed, so the rows are revalidated and then harvested again within the same build
+            self.server.profile = lambda k: (profile(k)[0], profile(k)[1].replace("synthetic profile", "changed profile"))
+            self.server.requests.clear()
+            cache.memory_size = 1024
+            registry, requests = self.build(manifest_folder)
+            spilled = len(cache.spilled)
+        finally:
+            cache.memory_size = memory_size
+            self.server.profile = profile
+            self.server.etags = True
+        self.assertEqual(len(registry.entry_errors), 0)
+        self.assertGreater(registry.metrics.report()["totals"].get("manifest_documents_changed", 0), 0)
+        self.assertGreater(spilled, 0)
+        self.assertEqual({uri: count for uri, count in requests.items() if count > 1}, {})
+        self.assertEqual({path: count for path, count in self.server.requests.items() if count > 1}, {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#this file will test the discovery of describedby links in the Link header and the html head of a response
+#usage: python tests/test_html_head.py
+import os
+import sys
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SRC_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), "src")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, SRC_FOLDER)
+
+from utils.httpcache import to_response
+from utils.html_head import describedby_links, scan_head, iter_chunks
+
+PAGE = "http://example.org/crates/crate/"
+
+def html_response(html, headers=None, url=PAGE):
+    '''
+    make a html response for the given page, like the http cache hands them to the harvester
+    '''
+    headers = dict(headers or {}, **{"Content-Type": "text/html; charset=utf-8"})
+    return to_response({"url": url, "status_code": 200, "encoding": "utf-8", "headers": headers}, html.encode("utf-8"))
+
+class TestHtmlHead(unittest.TestCase):
+    def test_rel_is_a_case_insensitive_list(self):
+        response = html_response(
+            "<html><head>"
+            "<link rel=\"alternate DescribedBy\" href=\"http://example.org/a.json\" type=\"application/ld+json\">"
+            "<link rel=\"describedbyx\" href=\"http://example.org/b.json\">"
+            "<LINK REL=\"DESCRIBEDBY\" HREF=\"http://example.org/c.json\">"
+            "</head></html>"
+        )
+        self.assertEqual(describedby_links(response), [
+            ("http://example.org/a.json", "application/ld+json"),
+            ("http://example.org/c.json", None),
+        ])
+
+    def test_link_header_comes_first(self):
+        response = html_response(
+            "<html><head><link rel=describedby href=page.json></head></html>",
+            headers={"Link": "<header.json>; rel=\"meta describedby\"; type=\"application/ld+json\", <other.json>; rel=\"alternate\""},
+        )
+        self.assertEqual(describedby_links(response), [
+            ("http://example.org/crates/crate/header.json", "application/ld+json"),
+            ("http://example.org/crates/crate/page.json", None),
+        ])
+
+    def test_unquoted_attributes(self):
+        response = html_response("<html><head><link rel=describedby href=./ro-crate-metadata.json type=application/ld+json/></head></html>")
+        self.assertEqual(describedby_links(response), [("http://example.org/crates/crate/ro-crate-metadata.json", "application/ld+json")])
+        #the / of a quoted value or of a value that is followed by a space is kept
+        response = html_response("<html><head><link rel=describedby type=\"application/ld+json\" href=\"../metadata/\"/><link rel=describedby href=dir/ /></head></html>")
+        self.assertEqual(describedby_links(response), [
+            ("http://example.org/crates/metadata/", "application/ld+json"),
+            ("http://example.org/crates/crate/dir/", None),
+        ])
+
+    def test_relative_hrefs(self):
+        response = html_response("<html><head><link rel=describedby href=\"../ro-crate-metadata.json\"></head></html>")
+        self.assertEqual(describedby_links(response), [("http://example.org/crates/ro-crate-metadata.json", None)])
+        #the base of the head is resolved against the page, and the hrefs against the base
+        response = html_response("<html><head><base href=\"/data/\"><link rel=describedby href=\" crate.json \"></head></html>")
+        self.assertEqual(describedby_links(response), [("http://example.org/data/crate.json", None)])
+
+    def test_scan_stops_at_the_head(self):
+        response = html_response("<html><head><title>crate</title></head><body><link rel=describedby href=body.json></body></html>")
+        self.assertEqual(describedby_links(response), [])
+        response = html_response("<html><title>crate</title><body><link rel=describedby href=body.json></body></html>")
+        self.assertEqual(describedby_links(response), [])
+
+    def test_byte_cap(self):
+        html = "<html><head><title>crate</title>" + "<meta name=padding content=x>" * 200 + "<link rel=describedby href=late.json></head></html>"
+        response = html_response(html)
+        self.assertEqual(describedby_links(response, max_bytes=len(html) // 2), [])
+        self.assertEqual(describedby_links(response, max_bytes=len(html)), [("http://example.org/crates/crate/late.json", None)])
+        #the scan reads no more chunks than it needs for the cap
+        chunks = []
+        def counting_chunks():
+            for chunk in iter_chunks(html.encode("utf-8"), size=100):
+                chunks.append(chunk)
+                yield chunk
+        scanner = scan_head(counting_chunks(), "utf-8", max_bytes=1000)
+        self.assertFalse(scanner.done)
+        self.assertEqual(len(chunks), 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+#this file will test that importing the harvester does not load the heavy libraries, they are only imported on first use
+#the import is done in a fresh interpreter by benchmark/import_time.py, see utils/lazy_import.py
+#usage: python tests/test_import_time.py
+import os
+import sys
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_FOLDER), "benchmark"))
+
+from import_time import measure, own_modules, HEAVY_MODULES
+
+#generous bound in seconds for importing the harvester, it takes well under 0.1s when the heavy libraries are not loaded
+IMPORT_TIME_BUDGET = float(os.environ.get("IMPORT_TIME_BUDGET", 0.5))
+
+class TestImportTime(unittest.TestCase):
+    def test_heavy_modules_are_not_imported(self):
+        for module in ("utils.registry", "utils.profileharvester", "utils.httpcache"):
+            _, loaded = measure(module)
+            self.assertEqual(loaded, [], f"importing {module} loaded {loaded}, one of {HEAVY_MODULES}")
+
+    def test_import_time(self):
+        #the fastest of a few runs, so a busy machine does not fail the test
+        runs = [measure("utils.registry")[0] for _ in range(3)]
+        total = min(own_modules(modules, "utils.registry")[-1][2] for modules in runs)
+        self.assertLess(total, IMPORT_TIME_BUDGET)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#this file will test that the build manifest only reuses rows whose documents were all harvested and did not change
+#the registry is served by the synthetic registry of the benchmark, see benchmark/synthetic_registry.py
+#usage: python tests/test_manifest.py
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SRC_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), "src")
+BENCHMARK_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), "benchmark")
+WORKDIR = tempfile.mkdtemp(prefix="registry-test-")
+#removed when the interpreter exits, the http cache is shared by the test files when they run in one process
+atexit.register(shutil.rmtree, WORKDIR, ignore_errors=True)
+#the settings of the harvester are read from the environment when its modules are imported
+os.environ.setdefault("HTTP_CACHE_DIR", os.path.join(WORKDIR, "cache", "http"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, SRC_FOLDER)
+sys.path.insert(0, BENCHMARK_FOLDER)
+
+from synthetic_registry import SyntheticRegistry
+from utils.singleton.location import Location
+from utils.httpclient import set_http_client
+from utils.httpcache import HttpCache
+from utils.ratelimiter import RateLimiter
+from utils.manifest import BuildManifest
+from utils.registry import Registry
+
+class TestManifest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = SyntheticRegistry(rows=10, fanout=3, profiles=6, describedby=0.5)
+        cls.server.start()
+        RateLimiter().configure_host(cls.server.base.split("://")[1], 1000)
+        shutil.copytree(os.path.join(SRC_FOLDER, "templates"), os.path.join(WORKDIR, "templates"))
+        os.makedirs(os.path.join(WORKDIR, "data"))
+        with open(os.path.join(WORKDIR, "data", "registry.csv"), "w") as f:
+            f.write(cls.server.csv())
+        Location().root = WORKDIR
+        cls.previous_client = set_http_client(None)
+        #a document that failed is requested again by the next build
+        failures = HttpCache().failures
+        cls.previous_failures = (failures.ttl, failures.threshold)
+        failures.ttl, failures.threshold = 0, 0
+        cls.profiles = {uri for i in range(cls.server.rows) for uri in cls.server.profile_uris(i)}
+
+    @classmethod
+    def tearDownClass(cls):
+        HttpCache().failures.ttl, HttpCache().failures.threshold = cls.previous_failures
+        set_http_client(cls.previous_client)
+        cls.server.stop()
+
+    def setUp(self):
+        self.manifest_folder = tempfile.mkdtemp(dir=WORKDIR)
+        self.server.failing = None
+
+    def build(self):
+        '''
+        build the registry with the manifest of this test
+        :return: the registry and the totals of its metrics
+        '''
+        registry = Registry(data_path=os.path.join(WORKDIR, "data"))
+        registry.manifest = BuildManifest(folder=self.manifest_folder)
+        registry.build()
+        return registry, registry.metrics.report()["totals"]
+
+    def test_failed_documents_are_harvested_again(self):
+        self.server.failing = "/profile/"
+        registry, totals = self.build()
+        self.assertEqual(len(registry.profile_metadate_dicts), 0)
+        self.assertEqual(len(registry.entry_warnings), self.server.rows)
+
+        #the host is back, the rows are not reused from the manifest of the failed build
+        self.server.failing = None
+        registry, totals = self.build()
+        self.assertEqual(set(registry.profile_metadate_dicts), self.profiles)
+        self.assertEqual(len(registry.entry_warnings), 0)
+
+        #now the rows are complete and reused
+        registry, totals = self.build()
+        self.assertEqual(set(registry.profile_metadate_dicts), self.profiles)
+        self.assertNotIn("documents_harvested", totals)
+
+    def test_changed_landing_page_is_noticed(self):
+        registry, totals = self.build()
+        self.assertEqual(set(registry.profile_metadate_dicts), self.profiles)
+        landing_pages = [i for i in range(self.server.rows) if self.server.entry_uri(i).endswith("/")]
+        self.assertGreater(len(landing_pages), 0)
+
+        landing_page = self.server.landing_page
+        self.server.landing_page = lambda i: (landing_page(i)[0], landing_page(i)[1].replace("<title>", "<title>changed "))
+        try:
+            registry, totals = self.build()
+        finally:
+            self.server.landing_page = landing_page
+        self.assertEqual(totals.get("manifest_documents_changed"), len(landing_pages))
+        self.assertEqual(set(registry.profile_metadate_dicts), self.profiles)
+
+if __name__ == "__main__":
+    unittest.main()
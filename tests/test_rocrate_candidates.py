@@ -0,0 +1,138 @@
+#this file will test that reading a plain ro-crate as json finds the same children as the candidate_profiles query on the parsed crate
+#usage: python tests/test_rocrate_candidates.py
+import os
+import sys
+import json
+import random
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SRC_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), "src")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, SRC_FOLDER)
+
+import rdflib
+from utils.jsonld_file import get_rocrate_candidates, ROCRATE_CONTEXTS
+from utils.parsepool import ParsePool
+from utils.queries import run_query
+from utils.httpcache import to_response
+from utils.profileharvester import ProfileHarvester
+
+BASE = "http://example.org/crate/ro-crate-metadata.json"
+
+CRATES = [
+    #profiles listed in an ItemList that is a part of the root
+    {"@context": "https://w3id.org/ro/crate/1.1/context", "@graph": [
+        {"@id": "ro-crate-metadata.json", "@type": "CreativeWork", "about": {"@id": "./"}, "conformsTo": {"@id": "https://w3id.org/ro/crate/1.1"}},
+        {"@id": "./", "@type": "Dataset", "hasPart": [{"@id": "#list"}]},
+        {"@id": "#list", "@type": "ItemList", "itemListElement": [{"@id": "http://example.org/profile/1"}, {"@id": "../profile/2"}]},
+    ]},
+    #the context in a list and an ItemList that is not in the crate itself
+    {"@context": ["https://w3id.org/ro/crate/1.3/context"], "@graph": [
+        {"@id": "./", "@type": "Dataset", "hasPart": {"@id": "http://example.org/list"}},
+        {"@id": "http://example.org/list", "itemListElement": {"@id": "http://example.org/profile/1"}},
+    ]},
+    #schema:conformsTo of the node the metadata descriptor is about
+    {"@context": "https://w3id.org/ro/crate/1.1/context", "@graph": [
+        {"@id": "ro-crate-metadata.json", "about": {"@id": "./"}},
+        {"@id": "./", "@type": "Dataset", "schema:conformsTo": [{"@id": "http://example.org/profile/3"}], "identifier": "abc"},
+    ]},
+    #no links at all
+    {"@context": "https://w3id.org/ro/crate/1.3/context", "@graph": [
+        {"@id": "./", "@type": "Dataset", "name": "empty"},
+    ]},
+]
+
+#crates the json walk can not answer the same way as the json-ld parser, they have to be parsed
+PARSED_CRATES = [
+    #a profile, its metadata is read from the graph
+    {"@context": "https://w3id.org/ro/crate/1.3/context", "@graph": [{"@id": "./", "@type": ["Dataset", "Profile"]}]},
+    #an inline context
+    {"@context": {"@vocab": "http://schema.org/"}, "@graph": [{"@id": "./", "hasPart": {"@id": "#list"}}]},
+    #an embedded node
+    {"@context": "https://w3id.org/ro/crate/1.1/context", "@graph": [{"@id": "./", "hasPart": {"@id": "#list", "itemListElement": {"@id": "http://example.org/profile/1"}}}]},
+]
+
+def parse(crate):
+    graph = rdflib.Dataset().graph(rdflib.URIRef(BASE))
+    ParsePool(workers=0).parse(graph, json.dumps(crate), "json-ld", publicID=BASE)
+    return graph
+
+def query_candidates(graph):
+    return {row[0] for row in run_query("candidate_profiles", graph)}
+
+def random_crate(rng):
+    '''
+    a crate made of random nodes, links and types with one of the ro-crate contexts
+    '''
+    ids = ["./", "ro-crate-metadata.json", "#registry", "https://w3id.org/ro/crate/1.1", "http://example.org/profile/1", "dct:x", "_:b1", "sub/", "../other"]
+    predicates = ["about", "conformsTo", "hasPart", "itemListElement", "name", "dct:conformsTo", "schema:conformsTo", "http://schema.org/conformsTo", "unknownTerm"]
+    types = ["Dataset", "CreativeWork", "Profile", "prof:Profile", "ItemList", ["Dataset", "Thing"]]
+    graph = []
+    for _ in range(rng.randint(1, 5)):
+        node = {}
+        if rng.random() < 0.9:
+            node["@id"] = rng.choice(ids)
+        if rng.random() < 0.7:
+            node["@type"] = rng.choice(types)
+        for _ in range(rng.randint(0, 4)):
+            values = [{"@id": rng.choice(ids)} if rng.random() < 0.85 else "literal" for _ in range(rng.randint(1, 2))]
+            node[rng.choice(predicates)] = values if len(values) > 1 else values[0]
+        graph.append(node)
+    return {"@context": rng.choice(ROCRATE_CONTEXTS), "@graph": graph}
+
+class TestRocrateCandidates(unittest.TestCase):
+    def assert_same_as_query(self, crate):
+        candidates = get_rocrate_candidates(crate, BASE)
+        if candidates is None:
+            return False
+        graph = parse(crate)
+        self.assertEqual(run_query("profiles", graph), [], json.dumps(crate))
+        self.assertEqual(set(candidates), query_candidates(graph), json.dumps(crate))
+        self.assertEqual(len(candidates), len(set(candidates)))
+        return True
+
+    def test_crates(self):
+        for crate in CRATES:
+            self.assertTrue(self.assert_same_as_query(crate), json.dumps(crate))
+
+    def test_crates_that_are_parsed(self):
+        for crate in PARSED_CRATES:
+            self.assertIsNone(get_rocrate_candidates(crate, BASE), json.dumps(crate))
+
+    def test_random_crates(self):
+        rng = random.Random(1)
+        read_as_json = sum(self.assert_same_as_query(random_crate(rng)) for _ in range(200))
+        #the comparison is only meaningful when the json walk answers a good part of the crates
+        self.assertGreater(read_as_json, 20)
+
+    def harvest(self, crate):
+        response = to_response({"url": BASE, "status_code": 200, "encoding": "utf-8", "headers": {"Content-Type": "application/ld+json"}}, json.dumps(crate).encode("utf-8"))
+        harvester = ProfileHarvester(BASE, response=response)
+        harvester.harvest_entry()
+        return harvester
+
+    def test_harvester_keeps_the_crate_triples(self):
+        #the children come from the json walk, the crate is parsed into its named graph when its triples are needed
+        crate = CRATES[0]
+        harvester = self.harvest(crate)
+        self.assertIsNotNone(harvester.unparsed)
+        self.assertEqual(len(harvester.document_graph), 0)
+        self.assertEqual(len(harvester.kg), len(parse(crate)))
+        self.assertIsNone(harvester.unparsed)
+        self.assertEqual({rdflib.URIRef(child.entry_uri) for child in harvester.children}, query_candidates(parse(crate)))
+
+    def test_crate_that_describes_a_profile_is_parsed(self):
+        crate = json.loads(json.dumps(CRATES[0]))
+        crate["@graph"].append({"@id": "http://example.org/profile/1", "name": "named by the crate"})
+        for described, name in ((False, None), (True, "named by the crate")):
+            harvester = self.harvest(crate if described else CRATES[0])
+            profile = next(child for child in harvester.children if str(child.entry_uri) == "http://example.org/profile/1")
+            profile.document_graph.parse(data="<http://example.org/profile/1> a <http://www.w3.org/ns/dx/prof/Profile> .", format="turtle")
+            profiles = harvester.getListDictsProfiles()
+            self.assertEqual(list(profiles), [rdflib.URIRef("http://example.org/profile/1")])
+            self.assertEqual(profiles[rdflib.URIRef("http://example.org/profile/1")]["name"], name and rdflib.Literal(name))
+            self.assertEqual(harvester.unparsed is None, described)
+
+if __name__ == "__main__":
+    unittest.main()